@@ -1,12 +1,23 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
 from typing import List
+import asyncio
+import hashlib
+import io
 import logging
+import os
+import zlib
+
+import anyio
 
 from .models.schemas import (
     DataSourceConfig, AnalysisRequest, SchemaInfo
 )
-from .services.analyzer import MultiSourceAnalyzer
+from .services.analyzer import MultiSourceAnalyzer, get_postgres_engine, get_clickhouse_client
 from .services.llm_service import LLMService
 from .services.pipeline_generator import PipelineGenerator
 
@@ -18,9 +29,72 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="AI ETL Assistant",
     description="ИИ-ассистент для автоматизации ETL процессов",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Предельный размер распакованного тела запроса
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(64 << 20)))
+
+class GzipRequestMiddleware:
+    """Распаковка тел запросов с Content-Encoding: gzip (источники с примерами данных)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers", [])) if scope["type"] == "http" else {}
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+        
+        # Распаковываем потоково с ограничением размера, чтобы маленькое сжатое
+        # тело не развернулось в гигабайты памяти
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+        size = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                data = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                while data:
+                    chunk = decompressor.decompress(data, MAX_DECOMPRESSED_BODY - size + 1)
+                    size += len(chunk)
+                    if size > MAX_DECOMPRESSED_BODY:
+                        await PlainTextResponse("Request body too large", status_code=413)(scope, receive, send)
+                        return
+                    chunks.append(chunk)
+                    data = decompressor.unconsumed_tail
+            if not decompressor.eof:
+                raise zlib.error("incomplete gzip body")
+        except zlib.error as e:
+            logger.error(f"Error decompressing request body: {str(e)}")
+            await PlainTextResponse("Invalid gzip body", status_code=400)(scope, receive, send)
+            return
+        body = b"".join(chunks)
+        
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+        
+        body_sent = False
+        
+        async def receive_decompressed():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+        
+        await self.app(scope, receive_decompressed, send)
+
+app.add_middleware(GzipRequestMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +109,24 @@ analyzer = MultiSourceAnalyzer()
 llm_service = LLMService()
 pipeline_generator = PipelineGenerator()
 
+@app.on_event("startup")
+async def configure_thread_pool():
+    # Анализ источников (pandas/SQL) выполняется в пуле потоков
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_service.aclose()
+
+async def analyze_missing_sources(sources: List[DataSourceConfig]) -> None:
+    """Параллельный анализ источников без schema_info"""
+    pending = [source for source in sources if not source.schema_info]
+    results = await asyncio.gather(*[
+        run_in_threadpool(analyzer.analyze_source, source) for source in pending
+    ])
+    for source, schema_info in zip(pending, results):
+        source.schema_info = schema_info.dict()
+
 @app.get("/")
 async def root():
     return {"message": "AI ETL Assistant API", "status": "running"}
@@ -43,12 +135,37 @@ async def root():
 async def analyze_data_source(source: DataSourceConfig) -> SchemaInfo:
     """Анализ одного источника данных"""
     try:
-        schema_info = analyzer.analyze_source(source)
+        schema_info = await run_in_threadpool(analyzer.analyze_source, source)
         return schema_info
     except Exception as e:
         logger.error(f"Error analyzing source: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze-sources")
+async def analyze_data_sources(sources: List[DataSourceConfig]) -> List[SchemaInfo]:
+    """Пакетный анализ нескольких источников за один запрос"""
+    try:
+        return await asyncio.gather(*[
+            run_in_threadpool(analyzer.analyze_source, source) for source in sources
+        ])
+    except Exception as e:
+        logger.error(f"Error analyzing sources: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def complete_csv_rows(head: bytes) -> bytes:
+    """Начало CSV до последней полной записи: перевод строки внутри кавычек запись не завершает"""
+    quotes = head.count(b'"')
+    end = len(head)
+    while True:
+        pos = head.rfind(b"\n", 0, end)
+        if pos < 0:
+            return head
+        # Четное число кавычек до перевода строки - он вне значения в кавычках
+        quotes -= head.count(b'"', pos, end)
+        if quotes % 2 == 0:
+            return head[:pos + 1]
+        end = pos
+
 @app.post("/upload-csv")
 async def upload_csv_file(file: UploadFile = File(...)) -> dict:
     """Загрузка и анализ CSV файла"""
@@ -56,24 +173,36 @@ async def upload_csv_file(file: UploadFile = File(...)) -> dict:
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail="File must be a CSV")
         
-        # Создаем временную конфигурацию источника
-        source_config = DataSourceConfig(
-            id="uploaded_csv",
-            name=file.filename,
-            type="csv",
-            config={
-                "file_data": file.file,
-                "delimiter": ",",
-                "encoding": "utf-8"
-            }
-        )
+        # Для анализа нужен только первый блок файла, хвост не читаем
+        head = await file.read(1 << 20)
+        await file.close()
+        candidates = [head]
+        if len(head) == 1 << 20:
+            # Обрезанную последнюю запись отбрасываем; если не получилось
+            # (например, ни одной полной записи), анализируем буфер как есть
+            candidates.insert(0, complete_csv_rows(head))
         
-        # Анализируем файл
-        schema_info = analyzer.analyze_source(source_config)
+        for data in dict.fromkeys(candidates):
+            # Создаем временную конфигурацию источника
+            source_config = DataSourceConfig(
+                id="uploaded_csv",
+                name=file.filename,
+                type="csv",
+                config={
+                    "file_data": io.BytesIO(data),
+                    "delimiter": ",",
+                    "encoding": "utf-8"
+                }
+            )
+            
+            # Анализируем файл
+            schema_info = await run_in_threadpool(analyzer.analyze_source, source_config)
+            if schema_info.columns:
+                break
         
         return {
             "filename": file.filename,
-            "schema": schema_info.dict(),
+            "schema": schema_info,
             "status": "success"
         }
         
@@ -86,9 +215,7 @@ async def find_data_relationships(sources: List[DataSourceConfig]) -> dict:
     """Поиск связей между источниками данных"""
     try:
         # Сначала анализируем все источники
-        for source in sources:
-            if not source.schema_info:
-                source.schema_info = analyzer.analyze_source(source).dict()
+        await analyze_missing_sources(sources)
         
         relationships = analyzer.find_relationships(sources)
         
@@ -101,20 +228,58 @@ async def find_data_relationships(sources: List[DataSourceConfig]) -> dict:
         logger.error(f"Error finding relationships: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def prepare_analysis(request: AnalysisRequest) -> tuple:
+    """Анализ источников, поиск связей и паттернов данных для запроса"""
+    # Анализируем источники данных
+    await analyze_missing_sources(request.sources)
+    
+    # Поиск связей между источниками
+    relationships = analyzer.find_relationships(request.sources)
+    
+    # Анализ паттернов данных
+    data_patterns = analyzer.analyze_data_patterns(request.sources)
+    
+    return relationships, data_patterns
+
+def build_recommendations_response(
+    request: AnalysisRequest,
+    ai_recommendations: dict,
+    relationships: list,
+    data_patterns: dict
+) -> dict:
+    """Генерация кода пайплайна и сборка ответа по рекомендациям"""
+    # Генерация Airflow DAG
+    goal_digest = hashlib.blake2b(request.business_requirements.goal.encode("utf-8"), digest_size=6).hexdigest()
+    project_name = f"project_{goal_digest}"
+    dag_code = pipeline_generator.generate_airflow_dag(
+        sources=request.sources,
+        recommendations=ai_recommendations,
+        relationships=relationships,
+        project_name=project_name
+    )
+    
+    # Генерация SQL скриптов
+    sql_scripts = pipeline_generator.generate_sql_scripts(ai_recommendations, relationships)
+    
+    return {
+        "recommendations": ai_recommendations,
+        "relationships": [rel.dict() for rel in relationships],
+        "data_patterns": data_patterns,
+        "generated_code": {
+            "airflow_dag": dag_code,
+            "sql_scripts": sql_scripts
+        },
+        "project_info": {
+            "name": project_name,
+            "estimated_runtime": ai_recommendations.get("etl_pipeline", {}).get("estimated_runtime", "unknown")
+        }
+    }
+
 @app.post("/generate-recommendations")
 async def generate_recommendations(request: AnalysisRequest) -> dict:
     """Генерация рекомендаций через ИИ"""
     try:
-        # Анализируем источники данных
-        for source in request.sources:
-            if not source.schema_info:
-                source.schema_info = analyzer.analyze_source(source).dict()
-        
-        # Поиск связей между источниками
-        relationships = analyzer.find_relationships(request.sources)
-        
-        # Анализ паттернов данных
-        data_patterns = analyzer.analyze_data_patterns(request.sources)
+        relationships, data_patterns = await prepare_analysis(request)
         
         # Генерация рекомендаций через LLM
         ai_recommendations = await llm_service.generate_recommendations(
@@ -123,78 +288,67 @@ async def generate_recommendations(request: AnalysisRequest) -> dict:
             data_patterns=data_patterns
         )
         
-        # Генерация Airflow DAG
-        project_name = f"project_{hash(str(request.business_requirements.goal))}"
-        dag_code = pipeline_generator.generate_airflow_dag(
-            sources=request.sources,
-            recommendations=ai_recommendations,
-            relationships=relationships,
-            project_name=project_name
-        )
+        return build_recommendations_response(request, ai_recommendations, relationships, data_patterns)
         
-        # Генерация SQL скриптов
-        sql_scripts = pipeline_generator.generate_sql_scripts(ai_recommendations)
+    except Exception as e:
+        logger.error(f"Error generating recommendations: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/generate-recommendations-batch")
+async def generate_recommendations_batch(requests: List[AnalysisRequest]) -> List[dict]:
+    """Пакетная генерация рекомендаций для нескольких наборов источников"""
+    try:
+        prepared = await asyncio.gather(*[prepare_analysis(request) for request in requests])
         
-        return {
-            "recommendations": ai_recommendations,
-            "relationships": [rel.dict() for rel in relationships],
-            "data_patterns": data_patterns,
-            "generated_code": {
-                "airflow_dag": dag_code,
-                "sql_scripts": sql_scripts
-            },
-            "project_info": {
-                "name": project_name,
-                "estimated_runtime": ai_recommendations.get("etl_pipeline", {}).get("estimated_runtime", "unknown")
+        # Запросы к LLM выполняются параллельно с ограничением конкурентности
+        ai_recommendations = await llm_service.generate_recommendations_batch([
+            {
+                "sources": request.sources,
+                "business_requirements": request.business_requirements,
+                "data_patterns": data_patterns
             }
-        }
+            for request, (_, data_patterns) in zip(requests, prepared)
+        ])
+        
+        return [
+            build_recommendations_response(request, recommendations, relationships, data_patterns)
+            for request, recommendations, (relationships, data_patterns)
+            in zip(requests, ai_recommendations, prepared)
+        ]
         
     except Exception as e:
-        logger.error(f"Error generating recommendations: {str(e)}")
+        logger.error(f"Error generating batch recommendations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def probe_connection(config: dict) -> None:
+    """Блокирующая проверка подключения к базе данных"""
+    if config.get("type") == "postgresql":
+        engine = get_postgres_engine(config, probe=True)
+        
+        # Пробуем подключиться
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1")).fetchone()
+        
+    elif config.get("type") == "clickhouse":
+        client, lock = get_clickhouse_client(config)
+        
+        with lock:
+            client.execute("SELECT 1")
+        
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported database type")
+
 @app.post("/test-connection")
 async def test_database_connection(config: dict) -> dict:
     """Тестирование подключения к базе данных"""
     try:
-        if config.get("type") == "postgresql":
-            from sqlalchemy import create_engine
-            
-            connection_string = (
-                f"postgresql://{config['username']}:{config['password']}"
-                f"@{config['host']}:{config.get('port', 5432)}/{config['database']}"
-            )
-            
-            engine = create_engine(connection_string)
-            
-            # Пробуем подключиться
-            with engine.connect() as conn:
-                conn.execute("SELECT 1").fetchone()
-                
-            return {"status": "success", "message": "Connection successful"}
-            
-        elif config.get("type") == "clickhouse":
-            from clickhouse_driver import Client
-            
-            client = Client(
-                host=config['host'],
-                port=config.get('port', 9000),
-                user=config.get('username', 'default'),
-                password=config.get('password', ''),
-                database=config.get('database', 'default')
-            )
-            
-            client.execute("SELECT 1")
-            
-            return {"status": "success", "message": "Connection successful"}
-            
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported database type")
+        await run_in_threadpool(probe_connection, config)
+        return {"status": "success", "message": "Connection successful"}
             
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-@app.get("/health")
+@app.api_route("/health", methods=["GET", "HEAD"])
 async def health_check():
     """Проверка здоровья сервиса"""
     return {
@@ -206,6 +360,15 @@ async def health_check():
         }
     }
 
-if __name__ == "main":
+if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1)),
+        loop="uvloop",
+        http="httptools",
+        timeout_keep_alive=75,  # прогретые frontend соединения не закрываются через 5 секунд
+        log_level="warning"
+    )
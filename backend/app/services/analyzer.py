@@ -1,32 +1,172 @@
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+from typing import Dict, List, Any, Optional, Union
+from collections import OrderedDict, defaultdict
+import hashlib
 import json
 import logging
-from sqlalchemy import create_engine
+import orjson
+import os
+import re
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
 from ..models.schemas import SchemaInfo, DataSourceConfig, SourceType, DataRelationship
 
 logger = logging.getLogger(__name__)
 
+# Ключевые слова для поиска временных и географических колонок
+TEMPORAL_KEYWORDS = ['date', 'time', 'created', 'updated', 'timestamp']
+GEO_KEYWORDS = ['lat', 'lon', 'city', 'country', 'region', 'address']
+
+TEMPORAL_RE = re.compile('|'.join(map(re.escape, TEMPORAL_KEYWORDS)))
+GEO_RE = re.compile('|'.join(map(re.escape, GEO_KEYWORDS)))
+
+# Общие объекты подключений к БД: ключ без пароля, не больше CONNECTION_CACHE_SIZE
+# на кэш, вытесненные и устаревшие после смены пароля закрываются
+CONNECTION_CACHE_SIZE = int(os.getenv("CONNECTION_CACHE_SIZE", "32"))
+_engine_lock = threading.Lock()
+
+# Пулы подключений PostgreSQL: (host, port, database, user, probe) -> (хэш пароля, engine)
+_engine_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+# Клиенты ClickHouse для проверки подключения: (host, port, database, user) -> (хэш пароля, (client, lock))
+_clickhouse_clients: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def _get_cached_connection(cache: OrderedDict, key: tuple, password: str, create, close):
+    """Объект подключения из LRU кэша; при смене пароля создается заново"""
+    digest = hashlib.blake2b(str(password).encode("utf-8"), digest_size=16).hexdigest()
+    stale = []
+    with _engine_lock:
+        entry = cache.get(key)
+        if entry is not None and entry[0] != digest:
+            stale.append(cache.pop(key)[1])
+            entry = None
+        if entry is None:
+            entry = (digest, create())
+            cache[key] = entry
+        cache.move_to_end(key)
+        while len(cache) > CONNECTION_CACHE_SIZE:
+            stale.append(cache.popitem(last=False)[1][1])
+    
+    for connection in stale:
+        try:
+            close(connection)
+        except Exception as e:
+            logger.warning(f"Error closing cached connection: {str(e)}")
+    return entry[1]
+
+def get_postgres_engine(config: Dict[str, Any], probe: bool = False) -> Engine:
+    """Получение общего SQLAlchemy engine с пулом соединений
+    
+    probe=True возвращает отдельный маленький пул с коротким таймаутом
+    подключения для проверки соединения.
+    """
+    connection_string = (
+        f"postgresql://{config['username']}:{config['password']}"
+        f"@{config['host']}:{config.get('port', 5432)}/{config['database']}"
+    )
+    
+    def create() -> Engine:
+        if probe:
+            return create_engine(
+                connection_string,
+                pool_size=1,
+                max_overflow=1,
+                pool_pre_ping=True,
+                connect_args={"connect_timeout": 3}
+            )
+        return create_engine(
+            connection_string,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+    
+    key = (config['host'], config.get('port', 5432), config['database'], config['username'], probe)
+    return _get_cached_connection(_engine_cache, key, config['password'], create, lambda engine: engine.dispose())
+
+def get_clickhouse_client(config: Dict[str, Any]) -> tuple:
+    """Получение общего клиента ClickHouse и блокировки для его использования"""
+    from clickhouse_driver import Client
+    
+    key = (
+        config['host'],
+        config.get('port', 9000),
+        config.get('database', 'default'),
+        config.get('username', 'default')
+    )
+    password = config.get('password', '')
+    
+    def create() -> tuple:
+        client = Client(
+            host=key[0],
+            port=key[1],
+            database=key[2],
+            user=key[3],
+            password=password,
+            connect_timeout=3
+        )
+        # Client не потокобезопасен, запросы через него сериализуем
+        return client, threading.Lock()
+    
+    def close(entry: tuple) -> None:
+        client, lock = entry
+        # Дожидаемся запроса, который мог выполняться через этот клиент
+        with lock:
+            client.disconnect()
+    
+    return _get_cached_connection(_clickhouse_clients, key, password, create, close)
+
 class MultiSourceAnalyzer:
     """Анализатор для множественных источников данных"""
     
-    def __init__(self):
+    def __init__(self, cache_dir: str = ".cache/schema", cache_size: int = 256):
         self.supported_types = [SourceType.CSV, SourceType.POSTGRESQL, SourceType.JSON, SourceType.EXCEL]
+        
+        # Кэш результатов анализа: в памяти (LRU) и на диске
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self._schema_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Схема таблиц в БД может измениться (ALTER TABLE, новые данные), поэтому
+        # для них кэш устаревает; файлы отслеживаются по содержимому/mtime
+        self.database_cache_ttl = int(os.getenv("SCHEMA_CACHE_TTL", "600"))
+        # Дисковый кэш ограничен числом файлов и их возрастом; очистка не чаще раза в минуту
+        self.disk_cache_max_files = int(os.getenv("SCHEMA_CACHE_MAX_FILES", "1024"))
+        self.disk_cache_max_age = int(os.getenv("SCHEMA_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+        self._last_prune = 0.0
     
     def analyze_source(self, source: DataSourceConfig) -> SchemaInfo:
         """Анализ одного источника данных"""
         try:
+            cache_key = self._source_fingerprint(source)
+            
+            is_file = "file_data" in source.config or bool(source.config.get("file_path"))
+            cached = self._get_cached_schema(cache_key, None if is_file else self.database_cache_ttl)
+            if cached is not None:
+                return cached
+            
             if source.type == SourceType.CSV:
-                return self._analyze_csv(source.config)
+                schema_info = self._analyze_csv(source.config)
             elif source.type == SourceType.POSTGRESQL:
-                return self._analyze_postgresql(source.config)
+                schema_info = self._analyze_postgresql(source.config)
             elif source.type == SourceType.JSON:
-                return self._analyze_json(source.config)
+                schema_info = self._analyze_json(source.config)
             elif source.type == SourceType.EXCEL:
-                return self._analyze_excel(source.config)
+                schema_info = self._analyze_excel(source.config)
             else:
                 raise ValueError(f"Unsupported source type: {source.type}")
+            
+            self._put_cached_schema(cache_key, schema_info)
+            return schema_info
                 
         except Exception as e:
             logger.error(f"Error analyzing source {source.name}: {str(e)}")
@@ -35,48 +175,226 @@ class MultiSourceAnalyzer:
                 row_count=0, null_counts={}, unique_counts={}
             )
     
+    def _source_fingerprint(self, source: DataSourceConfig) -> str:
+        """Стабильный ключ кэша для источника данных"""
+        config = {k: v for k, v in source.config.items() if k != "file_data"}
+        
+        if "file_data" in source.config:
+            # Загруженный файл: хэшируем весь буфер, он целиком участвует в анализе
+            file_data = source.config["file_data"]
+            position = file_data.tell()
+            file_data.seek(0)
+            digest = hashlib.blake2b(digest_size=16)
+            size = 0
+            while True:
+                chunk = file_data.read(1 << 20)
+                if not chunk:
+                    break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                digest.update(chunk)
+                size += len(chunk)
+            file_data.seek(position)
+            file_marker = [digest.hexdigest(), size]
+        elif config.get("file_path") and os.path.exists(config["file_path"]):
+            stat = os.stat(config["file_path"])
+            file_marker = [stat.st_mtime, stat.st_size]
+        else:
+            file_marker = None
+        
+        payload = json.dumps([source.type.value, config, file_marker], sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _get_cached_schema(self, key: str, max_age: Optional[float] = None) -> Optional[SchemaInfo]:
+        """Поиск результата анализа в памяти, затем на диске; max_age - срок жизни записи в секундах"""
+        now = time.time()
+        with self._cache_lock:
+            if key in self._schema_cache:
+                stored_at, schema_info = self._schema_cache[key]
+                if max_age is None or now - stored_at < max_age:
+                    self._schema_cache.move_to_end(key)
+                    return schema_info
+                del self._schema_cache[key]
+        
+        cache_path = os.path.join(self.cache_dir, f"{key}.json")
+        if not os.path.exists(cache_path):
+            return None
+        
+        try:
+            stored_at = os.path.getmtime(cache_path)
+            if max_age is not None and now - stored_at >= max_age:
+                os.remove(cache_path)
+                return None
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                schema_info = SchemaInfo(**json.load(f))
+        except Exception as e:
+            logger.warning(f"Error reading schema cache {cache_path}: {str(e)}")
+            return None
+        
+        self._remember_schema(key, schema_info, stored_at)
+        return schema_info
+    
+    def _put_cached_schema(self, key: str, schema_info: SchemaInfo) -> None:
+        """Сохранение результата анализа в память и на диск"""
+        self._remember_schema(key, schema_info)
+        
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Пишем во временный файл и атомарно подменяем: читатель не увидит часть записи
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(schema_info.json())
+                os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.json"))
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"Error writing schema cache: {str(e)}")
+        
+        if time.time() - self._last_prune >= 60:
+            self._last_prune = time.time()
+            self._prune_disk_cache()
+    
+    def _prune_disk_cache(self) -> None:
+        """Удаление устаревших записей и самых старых сверх лимита числа файлов"""
+        now = time.time()
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith((".json", ".tmp")):
+                        entries.append((entry.stat().st_mtime, entry.path))
+        except OSError as e:
+            logger.warning(f"Error listing schema cache: {str(e)}")
+            return
+        
+        entries.sort(reverse=True)
+        for position, (mtime, path) in enumerate(entries):
+            # Брошенные временные файлы удаляем через минуту после записи
+            max_age = 60 if path.endswith(".tmp") else self.disk_cache_max_age
+            if position >= self.disk_cache_max_files or now - mtime >= max_age:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    
+    def _remember_schema(self, key: str, schema_info: SchemaInfo, stored_at: Optional[float] = None) -> None:
+        with self._cache_lock:
+            self._schema_cache[key] = (stored_at if stored_at is not None else time.time(), schema_info)
+            self._schema_cache.move_to_end(key)
+            while len(self._schema_cache) > self.cache_size:
+                self._schema_cache.popitem(last=False)
+    
     def _analyze_csv(self, config: Dict[str, Any]) -> SchemaInfo:
         """Анализ CSV файла"""
-        if "file_data" in config:
-            # Streamlit uploaded file
-            df = pd.read_csv(
-                config["file_data"], 
-                delimiter=config.get("delimiter", ","),
-                encoding=config.get("encoding", "utf-8"),
-                nrows=1000  # Ограничиваем для быстрого анализа
-            )
-        else:
-            df = pd.read_csv(
-                config["file_path"],
-                delimiter=config.get("delimiter", ","), 
+        # Streamlit uploaded file или путь к файлу
+        source = config["file_data"] if "file_data" in config else config["file_path"]
+        
+        reader = pa_csv.open_csv(
+            source,
+            read_options=pa_csv.ReadOptions(
                 encoding=config.get("encoding", "utf-8"),
-                nrows=1000
-            )
+                block_size=1 << 20
+            ),
+            # Значения в кавычках могут содержать переводы строк
+            parse_options=pa_csv.ParseOptions(delimiter=config.get("delimiter", ","), newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(strings_can_be_null=True)
+        )
         
-        return self._create_schema_info(df)
+        # Для анализа достаточно первого блока, остаток файла не читаем
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            batch = pa.RecordBatch.from_pylist([], schema=reader.schema)
+        
+        return self._create_schema_info(batch.slice(0, 1000))  # Ограничиваем для быстрого анализа
     
     def _analyze_postgresql(self, config: Dict[str, Any]) -> SchemaInfo:
         """Анализ PostgreSQL таблицы"""
-        connection_string = (
-            f"postgresql://{config['username']}:{config['password']}"
-            f"@{config['host']}:{config.get('port', 5432)}/{config['database']}"
-        )
-        
-        engine = create_engine(connection_string)
-        query = f"SELECT * FROM {config['table']} LIMIT 1000"
+        engine = get_postgres_engine(config)
+        table = config['table']
         
-        df = pd.read_sql(query, engine)
-        engine.dispose()
+        # Транзакция нужна временной таблице с выборкой: она удаляется при завершении
+        with engine.begin() as conn:
+            # Колонки и типы берем из каталога, без выгрузки строк; имя таблицы
+            # разбирает сам сервер (кавычки, регистр, search_path)
+            column_rows = conn.execute(
+                text(
+                    "SELECT c.column_name, c.data_type FROM information_schema.columns c "
+                    "JOIN pg_class r ON r.oid = to_regclass(:table) "
+                    "JOIN pg_namespace n ON n.oid = r.relnamespace "
+                    "WHERE c.table_schema = n.nspname AND c.table_name = r.relname "
+                    "ORDER BY c.ordinal_position"
+                ),
+                {"table": table}
+            ).fetchall()
+            
+            if not column_rows:
+                raise ValueError(f"Table {table} not found")
+            
+            columns = [row[0] for row in column_rows]
+            
+            # Выборку из 1000 строк делаем один раз, чтобы статистики всех колонок
+            # считались по одним и тем же строкам
+            conn.execute(text(
+                f"CREATE TEMP TABLE analysis_sample ON COMMIT DROP AS SELECT * FROM {table} LIMIT 1000"
+            ))
+            
+            # Статистики считает PostgreSQL, широкие таблицы обрабатываем пачками по 32 колонки
+            row_count = 0
+            null_counts = {}
+            unique_counts = {}
+            
+            for start in range(0, len(columns), 32):
+                batch = columns[start:start + 32]
+                aggregates = ["count(*)"]
+                for col in batch:
+                    quoted = '"' + col.replace('"', '""') + '"'
+                    aggregates.append(f"count(*) FILTER (WHERE {quoted} IS NULL)")
+                    aggregates.append(f"count(DISTINCT {quoted}::text)")
+                
+                stats = conn.execute(text(
+                    f"SELECT {', '.join(aggregates)} FROM analysis_sample"
+                )).fetchone()
+                
+                row_count = stats[0]
+                for i, col in enumerate(batch):
+                    null_counts[col] = stats[1 + 2 * i]
+                    unique_counts[col] = stats[2 + 2 * i]
+            
+            sample_data = [
+                dict(row) for row in conn.execute(text("SELECT * FROM analysis_sample LIMIT 5")).mappings()
+            ]
         
-        return self._create_schema_info(df)
+        return SchemaInfo(
+            columns=columns,
+            dtypes={row[0]: row[1] for row in column_rows},
+            sample_data=sample_data,
+            row_count=row_count,
+            null_counts=null_counts,
+            unique_counts=unique_counts
+        )
     
     def _analyze_json(self, config: Dict[str, Any]) -> SchemaInfo:
         """Анализ JSON файла"""
+        source = config["file_data"] if "file_data" in config else config["file_path"]
+        is_json_lines = config.get(
+            "lines", str(config.get("file_path", "")).endswith((".jsonl", ".ndjson"))
+        )
+        
+        if is_json_lines:
+            # JSON Lines читаем напрямую в колоночный Arrow формат
+            table = pa_json.read_json(
+                source, read_options=pa_json.ReadOptions(block_size=1 << 20)
+            )
+            return self._create_schema_info(table.flatten().slice(0, 1000))
+        
         if "file_data" in config:
-            data = json.load(config["file_data"])
+            data = orjson.loads(config["file_data"].read())
         else:
-            with open(config["file_path"], 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(config["file_path"], 'rb') as f:
+                data = orjson.loads(f.read())
         
         # Преобразуем JSON в DataFrame
         if isinstance(data, list):
@@ -95,46 +413,86 @@ class MultiSourceAnalyzer:
         
         return self._create_schema_info(df)
     
-    def _create_schema_info(self, df: pd.DataFrame) -> SchemaInfo:
-        """Создание SchemaInfo из DataFrame"""
-        # Обработка NaN значений для JSON сериализации
-        df_clean = df.fillna("")
+    def _create_schema_info(self, data: Union[pd.DataFrame, pa.RecordBatch, pa.Table]) -> SchemaInfo:
+        """Создание SchemaInfo из DataFrame или Arrow RecordBatch/Table"""
+        if not isinstance(data, pd.DataFrame):
+            # Arrow данные обрабатываем без промежуточного DataFrame
+            columns = data.schema.names
+            
+            # Полностью пустые колонки Arrow выводит как тип null,
+            # для вложенных типов (списки, структуры) уникальность не считаем
+            unique_counts = {
+                name: 0 if pa.types.is_null(column.type) or pa.types.is_nested(column.type)
+                else pc.count_distinct(column).as_py()
+                for name, column in zip(columns, data.columns)
+            }
+            
+            return SchemaInfo(
+                columns=columns,
+                dtypes={name: str(dtype) for name, dtype in zip(columns, data.schema.types)},
+                sample_data=data.slice(0, 5).to_pylist(),
+                row_count=data.num_rows,
+                null_counts={name: column.null_count for name, column in zip(columns, data.columns)},
+                unique_counts=unique_counts
+            )
+        
+        df = data
         
+        # Статистики считаем одним проходом по всему DataFrame
+        null_counts = df.isna().sum()
+        unique_counts = df.nunique(dropna=True)
+
+        # Превью сериализуется в C: NaN -> null, даты -> ISO строки,
+        # как и в Arrow-ветке пустые значения приходят как null; точность
+        # чисел максимальная (по умолчанию pandas округляет до 10 знаков)
+        sample_data = orjson.loads(df.head(5).to_json(orient='records', date_format='iso', double_precision=15))
+
         return SchemaInfo(
             columns=df.columns.tolist(),
             dtypes={col: str(dtype) for col, dtype in df.dtypes.items()},
-            sample_data=df_clean.head(5).to_dict('records'),
+            sample_data=sample_data,
             row_count=len(df),
-            null_counts={col: int(df[col].isnull().sum()) for col in df.columns},
-            unique_counts={col: int(df[col].nunique()) for col in df.columns}
+            null_counts={col: int(count) for col, count in null_counts.items()},
+            unique_counts={col: int(count) for col, count in unique_counts.items()}
         )
     
     def find_relationships(self, sources: List[DataSourceConfig]) -> List[DataRelationship]:
         """Автоматический поиск связей между источниками"""
         relationships = []
         
-        for i, source1 in enumerate(sources):
-            for j, source2 in enumerate(sources[i+1:], i+1):
-                if not source1.schema_info or not source2.schema_info:
-                    continue
-                cols1 = set(source1.schema_info.get("columns", []))
-                cols2 = set(source2.schema_info.get("columns", []))
-                
-                common_fields = cols1.intersection(cols2)
-                
-                if common_fields:
-                    # Определяем наиболее вероятный ключ для JOIN
-                    primary_key = self._identify_primary_key(common_fields, source1, source2)
-                    
-                    confidence = len(common_fields) / max(len(cols1), len(cols2))
-                    
-                    relationships.append(DataRelationship(
-                        source1_id=source1.id,
-                        source2_id=source2.id,
-                        join_type="LEFT JOIN",  # По умолчанию
-                        join_keys={primary_key: primary_key} if primary_key else {},
-                        confidence=confidence
-                    ))
+        # Инвертированный индекс: колонка -> источники, в которых она есть
+        source_columns = {}
+        column_index = defaultdict(list)
+        for i, source in enumerate(sources):
+            if not source.schema_info:
+                continue
+            source_columns[i] = set(source.schema_info.get("columns", []))
+            for col in source_columns[i]:
+                column_index[col].append(i)
+        
+        # Общие поля только для пар источников, у которых они есть
+        common_fields_by_pair = defaultdict(set)
+        for col, source_ids in column_index.items():
+            for pos, i in enumerate(source_ids):
+                for j in source_ids[pos + 1:]:
+                    common_fields_by_pair[(i, j)].add(col)
+        
+        for i, j in sorted(common_fields_by_pair):
+            source1, source2 = sources[i], sources[j]
+            common_fields = common_fields_by_pair[(i, j)]
+            
+            # Определяем наиболее вероятный ключ для JOIN
+            primary_key = self._identify_primary_key(common_fields, source1, source2)
+            
+            confidence = len(common_fields) / max(len(source_columns[i]), len(source_columns[j]))
+            
+            relationships.append(DataRelationship(
+                source1_id=source1.id,
+                source2_id=source2.id,
+                join_type="LEFT JOIN",  # По умолчанию
+                join_keys={primary_key: primary_key} if primary_key else {},
+                confidence=confidence
+            ))
         
         return relationships
     
@@ -181,9 +539,6 @@ class MultiSourceAnalyzer:
             "suggested_partitioning": None
         }
         
-        temporal_keywords = ['date', 'time', 'created', 'updated', 'timestamp']
-        geo_keywords = ['lat', 'lon', 'city', 'country', 'region', 'address']
-        
         total_rows = 0
         all_columns = []
         
@@ -192,21 +547,15 @@ class MultiSourceAnalyzer:
                 total_rows += source.schema_info.get("row_count", 0)
                 columns = source.schema_info.get("columns", [])
                 all_columns.extend(columns)
-                
-                # Поиск временных колонок
-                for col in columns:
-                    col_lower = col.lower()
-                    if any(keyword in col_lower for keyword in temporal_keywords):
-                        patterns["has_temporal_data"] = True
-                        patterns["temporal_columns"].append(col)
-                
-                # Поиск географических колонок
-                for col in columns:
-                    col_lower = col.lower()
-                    if any(keyword in col_lower for keyword in geo_keywords):
-                        patterns["has_geographical_data"] = True
-                        patterns["geographical_columns"].append(col)
         
+        # Поиск временных и географических колонок сразу по всем источникам
+        column_index = pd.Index(all_columns, dtype=object).unique()
+        columns_lower = column_index.astype(str).str.lower()
+        
+        patterns["temporal_columns"] = column_index[columns_lower.str.contains(TEMPORAL_RE)].tolist()
+        patterns["geographical_columns"] = column_index[columns_lower.str.contains(GEO_RE)].tolist()
+        patterns["has_temporal_data"] = bool(patterns["temporal_columns"])
+        patterns["has_geographical_data"] = bool(patterns["geographical_columns"])
         patterns["total_estimated_rows"] = total_rows
         
         # Рекомендации по партицированию
@@ -1,7 +1,13 @@
 import httpx
-import json
+import asyncio
+import copy
+import hashlib
 import logging
-from typing import Dict, List, Any
+import orjson
+import time
+from collections import OrderedDict
+from string import Template
+from typing import Dict, List, Any, Optional
 from ..models.schemas import BusinessRequirements, DataSourceConfig
 import os
 from dotenv import load_dotenv
@@ -10,6 +16,37 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Разделы, без которых ответ LLM не считается рекомендациями
+REQUIRED_RESPONSE_KEYS = ("storage_recommendation", "etl_pipeline")
+
+# Шаблоны DDL и расписания для rule-based рекомендаций
+CLICKHOUSE_DDL_TEMPLATE = Template("""
+CREATE TABLE $table
+(
+    date Date,
+    timestamp DateTime,
+    -- Add your columns here based on source analysis
+) ENGINE = MergeTree()
+$partitioning
+ORDER BY ($order_by)
+""")
+
+POSTGRES_DDL_TEMPLATE = Template("""
+CREATE TABLE $table (
+    id SERIAL PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Add your columns here based on source analysis
+);
+$indexes
+""")
+
+SCHEDULE_BY_FREQUENCY = {
+    "once": "# Run once manually",
+    "hourly": "0 * * * *",
+    "daily": "0 2 * * *",
+    "weekly": "0 2 * * 0"
+}
+
 class LLMService:
     """Сервис для работы с языковыми моделями"""
     
@@ -21,6 +58,26 @@ class LLMService:
         # URLs для API
         self.yandex_url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
         self.deepseek_url = "https://api.deepseek.com/v1/chat/completions"
+        
+        # Общий HTTP клиент: соединения с API переиспользуются между запросами
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    
+        # Кэш ответов LLM по хэшу промпта
+        self.cache_enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.cache_ttl = int(os.getenv("LLM_CACHE_TTL", "3600"))
+        self.cache_size = 256
+        self._response_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        
+        # Ограничение параллельных запросов к LLM при пакетной генерации
+        self._batch_semaphore = asyncio.Semaphore(8)
+    
+    async def aclose(self):
+        """Закрытие HTTP клиента"""
+        await self._client.aclose()
     
     async def generate_recommendations(
         self, 
@@ -32,18 +89,25 @@ class LLMService:
         
         prompt = self._create_analysis_prompt(sources, business_requirements, data_patterns)
         
+        cache_key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             # Сначала пробуем YandexGPT
             if self.yandex_api_key:
                 response = await self._call_yandex_gpt(prompt)
-                if response:
-                    return self._parse_llm_response(response)
+                parsed = self._parse_llm_response(response) if response else {}
+                if parsed:
+                    return self._cache_response(cache_key, parsed)
             
             # Fallback на DeepSeek
             if self.deepseek_api_key:
                 response = await self._call_deepseek(prompt)
-                if response:
-                    return self._parse_llm_response(response)
+                parsed = self._parse_llm_response(response) if response else {}
+                if parsed:
+                    return self._cache_response(cache_key, parsed)
             
             # Если LLM недоступны, используем rule-based рекомендации
             return self._generate_rule_based_recommendations(sources, business_requirements, data_patterns)
@@ -52,6 +116,37 @@ class LLMService:
             logger.error(f"Error generating LLM recommendations: {str(e)}")
             return self._generate_rule_based_recommendations(sources, business_requirements, data_patterns)
     
+    async def generate_recommendations_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Пакетная генерация рекомендаций: каждый элемент - аргументы generate_recommendations"""
+        
+        async def generate(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+            async with self._batch_semaphore:
+                return await self.generate_recommendations(**kwargs)
+        
+        return await asyncio.gather(*[generate(kwargs) for kwargs in requests])
+    
+    def _get_cached_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получение рекомендаций из кэша, если запись не устарела"""
+        if not self.cache_enabled or key not in self._response_cache:
+            return None
+        
+        expires_at, result = self._response_cache[key]
+        if expires_at < time.monotonic():
+            del self._response_cache[key]
+            return None
+        
+        return copy.deepcopy(result)
+    
+    def _cache_response(self, key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Сохранение успешно распарсенного ответа LLM в кэш"""
+        if self.cache_enabled and result:
+            self._response_cache[key] = (time.monotonic() + self.cache_ttl, copy.deepcopy(result))
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.cache_size:
+                self._response_cache.popitem(last=False)
+        
+        return result
+    
     def _create_analysis_prompt(
         self, 
         sources: List[DataSourceConfig], 
@@ -97,6 +192,8 @@ class LLMService:
     "main_table": "название_таблицы",
     "partitioning": "стратегия партицирования или null",
     "indexes": ["список", "индексов"],
+    "order_by": ["колонки", "ключа", "сортировки"],
+    "low_cardinality": ["категориальные", "строковые", "колонки"],
     "ddl_script": "CREATE TABLE ..."
   }},
   "etl_pipeline": {{
@@ -130,15 +227,14 @@ class LLMService:
             ]
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(self.yandex_url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["result"]["alternatives"][0]["message"]["text"]
-            else:
-                logger.error(f"YandexGPT API error: {response.status_code} - {response.text}")
-                return None
+        response = await self._client.post(self.yandex_url, headers=headers, json=data)
+        
+        if response.status_code == 200:
+            result = response.json()
+            return result["result"]["alternatives"][0]["message"]["text"]
+        else:
+            logger.error(f"YandexGPT API error: {response.status_code} - {response.text}")
+            return None
     
     async def _call_deepseek(self, prompt: str) -> str:
         """Вызов DeepSeek API"""
@@ -159,32 +255,74 @@ class LLMService:
             "max_tokens": 2000
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(self.deepseek_url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                logger.error(f"DeepSeek API error: {response.status_code} - {response.text}")
-                return None
+        response = await self._client.post(self.deepseek_url, headers=headers, json=data)
+        
+        if response.status_code == 200:
+            result = response.json()
+            return result["choices"][0]["message"]["content"]
+        else:
+            logger.error(f"DeepSeek API error: {response.status_code} - {response.text}")
+            return None
     
     def _parse_llm_response(self, response: str) -> Dict[str, Any]:
-        """Парсинг ответа от LLM"""
+        """Парсинг ответа от LLM; пустой словарь, если рекомендаций в ответе нет"""
+        # Ответ целиком является JSON
         try:
-            # Извлекаем JSON из ответа
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            
-            if start != -1 and end != 0:
-                json_str = response[start:end]
-                return json.loads(json_str)
-            else:
-                raise ValueError("JSON not found in response")
-                
-        except Exception as e:
-            logger.error(f"Error parsing LLM response: {str(e)}")
-            return {}
+            result = orjson.loads(response)
+            if self._is_recommendations(result):
+                return result
+        except orjson.JSONDecodeError:
+            pass
+        
+        # Ищем в тексте ответа JSON объект верхнего уровня с рекомендациями;
+        # после неудачного объекта продолжаем за его концом, а не внутри него
+        start = response.find('{')
+        while start != -1:
+            end = self._find_object_end(response, start)
+            if end == -1:
+                break
+            try:
+                result = orjson.loads(response[start:end])
+                if self._is_recommendations(result):
+                    return result
+            except orjson.JSONDecodeError:
+                pass
+            start = response.find('{', end)
+        
+        logger.error(f"Error parsing LLM response: recommendations JSON not found in response: {response[:200]!r}")
+        return {}
+    
+    @staticmethod
+    def _is_recommendations(result: Any) -> bool:
+        """Объект содержит обязательные разделы рекомендаций"""
+        return isinstance(result, dict) and all(key in result for key in REQUIRED_RESPONSE_KEYS)
+    
+    @staticmethod
+    def _find_object_end(text: str, start: int) -> int:
+        """Позиция после закрывающей скобки объекта, начинающегося в start (-1 если не закрыт)"""
+        depth = 0
+        in_string = False
+        escaped = False
+        
+        for pos in range(start, len(text)):
+            char = text[pos]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    return pos + 1
+        
+        return -1
     
     def _generate_rule_based_recommendations(
         self, 
@@ -228,34 +366,19 @@ class LLMService:
         main_table = "analytics_data" if is_analytics else "processed_data"
         
         if storage == "clickhouse":
-            ddl = f"""
-CREATE TABLE {main_table}
-(
-    date Date,
-    timestamp DateTime,
-    -- Add your columns here based on source analysis
-) ENGINE = MergeTree()
-{partitioning if partitioning else ''}
-ORDER BY ({', '.join(indexes) if indexes else 'date'})
-"""
+            ddl = CLICKHOUSE_DDL_TEMPLATE.substitute(
+                table=main_table,
+                partitioning=partitioning or '',
+                order_by=', '.join(indexes) if indexes else 'date'
+            )
         else:
-            ddl = f"""
-CREATE TABLE {main_table} (
-    id SERIAL PRIMARY KEY,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    -- Add your columns here based on source analysis
-);
-{f"CREATE INDEX ON {main_table} ({', '.join(indexes)});" if indexes else ''}
-"""
+            ddl = POSTGRES_DDL_TEMPLATE.substitute(
+                table=main_table,
+                indexes=f"CREATE INDEX ON {main_table} ({', '.join(indexes)});" if indexes else ''
+            )
         
         # Расписание
-        freq_map = {
-            "once": "# Run once manually",
-            "hourly": "0 * * * *",
-            "daily": "0 2 * * *", 
-            "weekly": "0 2 * * 0"
-        }
-        schedule = freq_map.get(business_requirements.update_frequency.value, "0 2 * * *")
+        schedule = SCHEDULE_BY_FREQUENCY.get(business_requirements.update_frequency.value, "0 2 * * *")
         
         return {
             "storage_recommendation": {
@@ -1,15 +1,172 @@
 import os
-from typing import Dict, List, Any
+import re
+import json
+import functools
+from string import Template
+from typing import Dict, List, Any, Tuple
 from datetime import datetime, timedelta
 from ..models.schemas import DataSourceConfig, DataRelationship
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Параметры записи промежуточных Parquet файлов в сгенерированных DAG
+DEFAULT_PARQUET_OPTIONS = {
+    "compression": "zstd",
+    "compression_level": 3,
+    "row_group_size": 1_048_576,
+    "use_dictionary": True,
+    "data_page_size": 1 << 20,
+    "write_statistics": True,
+}
+
+# Переменные окружения подключения к ClickHouse, подставляемые в код загрузки
+CLICKHOUSE_ENV_DEFAULTS = (
+    ("CLICKHOUSE_HOST", "localhost"),
+    ("CLICKHOUSE_HTTP_PORT", "8123"),
+    ("CLICKHOUSE_USER", "default"),
+    ("CLICKHOUSE_PASSWORD", ""),
+    ("CLICKHOUSE_DATABASE", "default"),
+)
+
+def _cached_by_source(render):
+    """Кэширует сгенерированный код по id, имени, типу и конфигурации источника"""
+    
+    @functools.lru_cache(maxsize=1024)
+    def render_cached(source_id: str, name: str, source_type: str, config_json: str) -> str:
+        source = DataSourceConfig(
+            id=source_id, name=name, type=source_type, config=json.loads(config_json)
+        )
+        return render(source)
+    
+    @functools.wraps(render)
+    def wrapper(source: DataSourceConfig) -> str:
+        config_json = json.dumps(source.config, sort_keys=True, default=str)
+        return render_cached(source.id, source.name, source.type.value, config_json)
+    
+    wrapper.cache_info = render_cached.cache_info
+    wrapper.cache_clear = render_cached.cache_clear
+    return wrapper
+
+# Способы передачи данных от извлечения к трансформации
+HAND_OFF_MODES = ("parquet_disk", "arrow_ipc", "shared_memory")
+
+# Вспомогательный код DAG для записи и чтения промежуточных результатов извлечения
+HAND_OFF_HELPERS = '''
+if HAND_OFF == 'shared_memory' and conf.get('core', 'executor') not in ('SequentialExecutor', 'LocalExecutor'):
+    # Разделяемая память доступна только задачам на одной машине
+    HAND_OFF = 'parquet_disk'
+
+
+class HandOffWriter:
+    """Потоковая запись результата извлечения выбранным способом передачи"""
+
+    def __init__(self, name, schema):
+        self.schema = schema
+        self.location = None
+        if HAND_OFF == 'parquet_disk':
+            # row_group_size задается при записи, а не при создании ParquetWriter
+            options = dict(PARQUET_OPTIONS)
+            self.row_group_size = options.pop('row_group_size', None)
+            self.location = f'/tmp/{name}.parquet'
+            self.writer = papq.ParquetWriter(self.location, schema, **options)
+        elif HAND_OFF == 'arrow_ipc':
+            self.location = f'/tmp/{name}.arrow'
+            self.writer = pa.ipc.new_file(self.location, schema)
+        else:
+            self.sink = pa.BufferOutputStream()
+            self.writer = pa.ipc.new_stream(self.sink, schema)
+
+    def write_table(self, table):
+        if HAND_OFF == 'parquet_disk':
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_table(table)
+
+    def close(self):
+        """Закрывает writer и возвращает адрес результата для XCom"""
+        self.writer.close()
+        if HAND_OFF == 'shared_memory':
+            buf = self.sink.getvalue()
+            shm = shared_memory.SharedMemory(create=True, size=max(buf.size, 1))
+            shm.buf[:buf.size] = memoryview(buf).cast('B')
+            # Сегмент должен пережить процесс задачи, удаляет его задача release_hand_off
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            self.location = shm.name
+            shm.close()
+        return self.location
+
+
+def read_hand_off(location):
+    """Читает результат извлечения, переданный через arrow_ipc или shared_memory"""
+    if HAND_OFF == 'arrow_ipc':
+        return pa.ipc.open_file(pa.memory_map(location)).read_all()
+    # Чтение не удаляет сегмент: повторная попытка трансформации читает его снова
+    shm = shared_memory.SharedMemory(name=location)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        return pa.ipc.open_stream(pa.py_buffer(bytes(shm.buf))).read_all()
+    finally:
+        shm.close()
+
+
+def release_hand_off(extract_task_ids, **context):
+    """Удаляет сегменты разделяемой памяти после завершения трансформации, в том числе неудачного"""
+    if HAND_OFF != 'shared_memory':
+        return
+    for task_id in extract_task_ids:
+        location = context['ti'].xcom_pull(task_ids=task_id)
+        if not location:
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=location)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+        logging.info(f"Released shared memory {location} from {task_id}")
+'''
+
+# Код объединения источников в трансформации: план джойнов рассчитывается
+# генератором, список колонок - во время выполнения по фактическим данным
+JOIN_CODE_TEMPLATE = Template("""            # Объединение данных хеш-джойнами DuckDB, без промежуточных DataFrame
+            join_plan = $join_plan
+            selected = {name: f'm.{quote_identifier(name)}' for name in columns[$main_source]}
+            joins = []
+            for other_source, join_key in join_plan:
+                if other_source in columns and join_key in selected and join_key in columns[other_source]:
+                    alias = f'j{len(joins)}'
+                    joins.append(
+                        f'LEFT JOIN {quote_identifier(other_source)} AS {alias} '
+                        f'ON {selected[join_key]} = {alias}.{quote_identifier(join_key)}'
+                    )
+                    # Совпадающие колонки получают суффикс источника, как в pandas merge,
+                    # и номер, если такое имя уже занято
+                    for name in columns[other_source]:
+                        if name != join_key:
+                            output_name = name if name not in selected else f'{name}_{other_source}'
+                            number = 2
+                            while output_name in selected:
+                                output_name = f'{name}_{other_source}_{number}'
+                                number += 1
+                            selected[output_name] = f'{alias}.{quote_identifier(name)}'
+                    logging.info(f"Joined with {other_source} on {join_key}")
+            
+            select_list = ", ".join(f'{expr} AS {quote_identifier(name)}' for name, expr in selected.items())
+            query = f"SELECT {select_list} FROM {quote_identifier($main_source)} AS m " + " ".join(joins)
+""")
+
+UNION_CODE = """            # Объединение всех источников данных по именам колонок: недостающие
+            # колонки заполняются null, типы приводятся к общему без перехода в object
+            query = " UNION ALL BY NAME ".join(
+                f"SELECT * FROM {quote_identifier(source_id)}" for source_id in columns
+            )
+"""
+
 class PipelineGenerator:
     """Генератор ETL пайплайнов"""
     
-    def ___init__(self, airflow_dags_path: str = "/opt/airflow/dags"):
+    def __init__(self, airflow_dags_path: str = "/opt/airflow/dags"):
         self.airflow_dags_path = airflow_dags_path
     
     def generate_airflow_dag(
@@ -30,15 +187,46 @@ class PipelineGenerator:
         else:
             schedule_interval = schedule
         
-        dag_code = f'''
+        # Параметры Parquet можно переопределить через рекомендации
+        parquet_options = dict(DEFAULT_PARQUET_OPTIONS)
+        if isinstance(recommendations.get("parquet_opts"), dict):
+            parquet_options.update(recommendations["parquet_opts"])
+        
+        # Способ передачи данных между задачами
+        hand_off = recommendations.get("pipeline", {}).get("hand_off", "parquet_disk")
+        if hand_off not in HAND_OFF_MODES:
+            logger.warning(f"Unknown hand-off mode {hand_off}, using parquet_disk")
+            hand_off = "parquet_disk"
+        
+        # После загрузки в PostgreSQL обновляем статистику планировщика отдельной задачей
+        storage_type = recommendations.get("storage_recommendation", {}).get("primary", "postgresql")
+        post_load_analyze = storage_type.lower() != "clickhouse"
+        sql_operator_import = (
+            "from airflow.providers.common.sql.operators.sql import SQLExecuteQueryOperator\n"
+            if post_load_analyze else ""
+        )
+        
+        parts = [f'''
 from datetime import datetime, timedelta
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
-from airflow.providers.postgres.operators.postgres import PostgresOperator
-from airflow.providers.postgres.hooks.postgres import PostgresHook
+from airflow.utils.task_group import TaskGroup
+from airflow.configuration import conf
+{sql_operator_import}from airflow.providers.postgres.hooks.postgres import PostgresHook
+import io
+from multiprocessing import resource_tracker, shared_memory
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as papq
 import logging
 
+# Параметры записи промежуточных Parquet файлов
+PARQUET_OPTIONS = {parquet_options!r}
+
+# Передача данных от извлечения к трансформации: {", ".join(HAND_OFF_MODES)}
+HAND_OFF = {hand_off!r}
+{HAND_OFF_HELPERS}
 # DAG конфигурация
 default_args = {{
     'owner': 'ai-assistant',
@@ -57,47 +245,51 @@ dag = DAG(
     schedule_interval={f'"{schedule_interval}"' if schedule_interval else "None"},
     catchup=False,
     tags=['auto-generated', 'etl'],
+    # Все извлечения могут выполняться параллельно; общие пределы задаются
+    # в airflow.cfg: [core] parallelism и max_active_tasks_per_dag
+    max_active_tasks={len(sources) + 2},
+    max_active_runs=1,
 )
 
 # Функции для извлечения данных
-'''
+''']
         
         # Добавляем функции извлечения для каждого источника
-        for source in sources:
-            if source.type.value == "csv":
-                dag_code += self._generate_csv_extract_function(source)
-            elif source.type.value == "postgresql":
-                dag_code += self._generate_postgres_extract_function(source)
-            elif source.type.value == "json":
-                dag_code += self._generate_json_extract_function(source)
+        extract_generators = {
+            "csv": self._generate_csv_extract_function,
+            "postgresql": self._generate_postgres_extract_function,
+            "json": self._generate_json_extract_function,
+        }
+        parts.extend(
+            extract_generators[source.type.value](source)
+            for source in sources
+            if source.type.value in extract_generators
+        )
         
         # Функция трансформации
-        dag_code += self._generate_transform_function(sources, relationships, recommendations)
+        parts.append(self._generate_transform_function(sources, relationships, recommendations))
         
         # Функция загрузки
-        dag_code += self._generate_load_function(recommendations)
+        parts.append(self._generate_load_function(recommendations))
         
         # Определение задач
-        dag_code += f'''
+        parts.append('''
 
-# Задачи DAG
-extract_tasks = []
-'''
+# Задачи DAG: извлечения независимы и выполняются параллельно
+with TaskGroup('extract', dag=dag) as extract_group:
+''')
         
         # Создаем задачи извлечения
-        for i, source in enumerate(sources):
-            task_id = f"extract_{source.id}"
-            dag_code += f'''
-{task_id} = PythonOperator(
-    task_id='{task_id}',
-    python_callable=extract_{source.id},
-    dag=dag,
-)
-extract_tasks.append({task_id})
-'''
+        parts.extend(f'''
+    extract_{source.id} = PythonOperator(
+        task_id='extract_{source.id}',
+        python_callable=extract_{source.id},
+        dag=dag,
+    )
+''' for source in sources)
         
         # Задача трансформации
-        dag_code += '''
+        parts.append('''
 transform_task = PythonOperator(
     task_id='transform_data',
     python_callable=transform_data,
@@ -112,94 +304,340 @@ load_task = PythonOperator(
 )
 
 # Определение зависимостей
-extract_tasks >> transform_task >> load_task
-'''
+extract_group >> transform_task >> load_task
+''')
+        
+        # Разделяемую память освобождаем, когда трансформация завершилась окончательно
+        # (all_done ждет и ее повторных попыток), даже если она или извлечения упали
+        if hand_off == "shared_memory":
+            extract_task_ids = [f"extract.extract_{source.id}" for source in sources]
+            parts.append(f'''
+release_task = PythonOperator(
+    task_id='release_hand_off',
+    python_callable=release_hand_off,
+    op_kwargs={{'extract_task_ids': {extract_task_ids!r}}},
+    trigger_rule='all_done',
+    dag=dag,
+)
+
+transform_task >> release_task
+''')
         
-        return dag_code
+        if post_load_analyze:
+            table_name = recommendations.get("schema_design", {}).get("main_table", "processed_data")
+            parts.append(f'''
+# VACUUM не выполняется внутри транзакции, поэтому autocommit
+post_load_analyze = SQLExecuteQueryOperator(
+    task_id='post_load_analyze',
+    conn_id='postgres_default',
+    sql='VACUUM (ANALYZE) {table_name};',
+    autocommit=True,
+    dag=dag,
+)
+
+load_task >> post_load_analyze
+''')
+        
+        # Собираем код одним join вместо повторных конкатенаций
+        return "".join(parts)
     
-    def _generate_csv_extract_function(self, source: DataSourceConfig) -> str:
+    @staticmethod
+    @_cached_by_source
+    def _generate_csv_extract_function(source: DataSourceConfig) -> str:
         """Генерация функции извлечения из CSV"""
         return f'''
 def extract_{source.id}(**context):
     """Extract data from CSV source: {source.name}"""
     try:
-        import pandas as pd
+        import pyarrow.csv as pacsv
         
-        df = pd.read_csv(
+        # Многопоточный Arrow CSV reader, без промежуточного DataFrame
+        table = pacsv.read_csv(
             '{source.config.get("file_path", "")}',
-            delimiter='{source.config.get("delimiter", ",")}',
-            encoding='{source.config.get("encoding", "utf-8")}'
+            read_options=pacsv.ReadOptions(
+                encoding='{source.config.get("encoding", "utf-8")}',
+                use_threads=True
+            ),
+            parse_options=pacsv.ParseOptions(delimiter='{source.config.get("delimiter", ",")}')
         )
         
-        # Сохраняем во временное хранилище (XCom или файл)
-        df.to_parquet(f'/tmp/{source.id}_data.parquet', index=False)
+        # Сохраняем во временное хранилище, адрес передается через XCom
+        writer = HandOffWriter('{source.id}_data', table.schema)
+        writer.write_table(table)
+        location = writer.close()
         
-        logging.info(f"Extracted {{len(df)}} rows from {source.name}")
-        return f'/tmp/{source.id}_data.parquet'
+        logging.info(f"Extracted {{table.num_rows}} rows from {source.name}")
+        return location
         
     except Exception as e:
         logging.error(f"Error extracting from {source.name}: {{str(e)}}")
         raise
 '''
     
-    def _generate_postgres_extract_function(self, source: DataSourceConfig) -> str:
+    @staticmethod
+    @_cached_by_source
+    def _generate_postgres_extract_function(source: DataSourceConfig) -> str:
         """Генерация функции извлечения из PostgreSQL"""
         return f'''
 def extract_{source.id}(**context):
     """Extract data from PostgreSQL source: {source.name}"""
     try:
-        from airflow.providers.postgres.hooks.postgres import PostgresHook
-        import pandas as pd
+        import json
         
         # Используем Airflow connection или создаем новое подключение
         pg_hook = PostgresHook(postgres_conn_id='postgres_default')
         
-        # Альтернативный способ подключения с явными параметрами
-        # connection_string = "postgresql://{source.config.get('username')}:{source.config.get('password')}@{source.config.get('host')}:{source.config.get('port', 5432)}/{source.config.get('database')}"
+        # Альтернативный способ подключения с явными параметрами (пароль - из окружения)
+        # connection_string = f"postgresql://{source.config.get('username')}:{{os.environ['PGPASSWORD']}}@{source.config.get('host')}:{source.config.get('port', 5432)}/{source.config.get('database')}"
         
         query = "SELECT * FROM {source.config.get('table')}"
-        df = pg_hook.get_pandas_df(sql=query)
         
-        # Сохраняем во временное хранилище
-        df.to_parquet(f'/tmp/{source.id}_data.parquet', index=False)
+        # Типы Arrow по OID типов PostgreSQL: схема задается описанием колонок
+        # результата и не зависит от значений в отдельных пачках
+        pg_types = {{
+            16: pa.bool_(), 17: pa.binary(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 26: pa.int64(),
+            700: pa.float32(), 701: pa.float64(), 1082: pa.date32(), 1083: pa.time64('us'),
+            1114: pa.timestamp('us'), 1184: pa.timestamp('us', tz='UTC'), 1186: pa.duration('us'),
+        }}
         
-        logging.info(f"Extracted {{len(df)}} rows from {source.name}")
-        return f'/tmp/{source.id}_data.parquet'
+        def arrow_type(column):
+            if column.type_code == 1700 and column.precision and column.precision <= 38:
+                return pa.decimal128(column.precision, column.scale or 0)
+            # NUMERIC без точности (масштаб меняется от строки к строке), текст,
+            # json, uuid, массивы и прочие типы сохраняем строками
+            return pg_types.get(column.type_code, pa.string())
+        
+        def to_array(values, arrow_type):
+            try:
+                return pa.array(values, type=arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                if not pa.types.is_string(arrow_type):
+                    raise
+                return pa.array([
+                    None if v is None else v if isinstance(v, str)
+                    else json.dumps(v, default=str) if isinstance(v, (dict, list)) else str(v)
+                    for v in values
+                ], arrow_type)
+        
+        # Серверный курсор: строки приходят пачками и сразу пишутся в хранилище
+        conn = pg_hook.get_conn()
+        row_count = 0
+        try:
+            with conn.cursor(name='extract_{source.id}') as cur:
+                cur.itersize = 100_000
+                cur.execute(query)
+                # Описание колонок серверного курсора доступно после первой выборки
+                rows = cur.fetchmany(100_000)
+                schema = pa.schema([pa.field(column.name, arrow_type(column)) for column in cur.description])
+                writer = HandOffWriter('{source.id}_data', schema)
+                while rows:
+                    arrays = [to_array(list(values), field.type) for values, field in zip(zip(*rows), schema)]
+                    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                    row_count += len(rows)
+                    rows = cur.fetchmany(100_000)
+            location = writer.close()
+        finally:
+            conn.close()
+        
+        logging.info(f"Extracted {{row_count}} rows from {source.name}")
+        return location
         
     except Exception as e:
         logging.error(f"Error extracting from {source.name}: {{str(e)}}")
         raise
 '''
     
-    def _generate_json_extract_function(self, source: DataSourceConfig) -> str:
+    @staticmethod
+    @_cached_by_source
+    def _generate_json_extract_function(source: DataSourceConfig) -> str:
         """Генерация функции извлечения из JSON"""
-        return f'''
-def extract_{source.id}(**context):
-    """Extract data from JSON source: {source.name}"""
-    try:
-        import pandas as pd
-        import json
+        file_path = source.config.get("file_path", "")
+        is_json_lines = source.config.get(
+            "lines", str(file_path).endswith((".jsonl", ".ndjson"))
+        )
         
-        with open('{source.config.get("file_path", "")}', 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if is_json_lines:
+            # JSON Lines читается Arrow напрямую, многопоточно и блоками
+            read_code = f'''
+        import pyarrow.json as paj
         
-        # Преобразуем в DataFrame
-        if isinstance(data, list):
-            df = pd.json_normalize(data)
+        table = paj.read_json(
+            '{file_path}',
+            read_options=paj.ReadOptions(use_threads=True, block_size=1 << 20)
+        )
+        table = flatten_table(table)
+        writer = HandOffWriter('{source.id}_data', table.schema)
+        writer.write_table(table)
+        location = writer.close()
+        row_count = table.num_rows
+'''
         else:
-            df = pd.json_normalize([data])
+            # Массив записей читается потоково пачками, без полного дерева объектов.
+            # Схема пачек может различаться, поэтому файл читается дважды: первый
+            # проход выводит общую схему, второй приводит к ней пачки и пишет их
+            read_code = f'''
+        import ijson
+        import json
+        
+        def as_text(value):
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+        
+        def flatten_record(record, prefix=''):
+            flat = {{}}
+            for key, value in record.items():
+                if isinstance(value, dict) and value:
+                    flat.update(flatten_record(value, f'{{prefix}}{{key}}.'))
+                else:
+                    flat[f'{{prefix}}{{key}}'] = value
+            return flat
+        
+        def batch_table(batch):
+            try:
+                return flatten_table(pa.Table.from_struct_array(pa.array(batch)))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Типы значений различаются внутри пачки: колонки собираем
+                # по отдельности, несовместимые значения сохраняем строками
+                rows = [flatten_record(record) for record in batch]
+                names = list(dict.fromkeys(name for row in rows for name in row))
+                arrays = []
+                for name in names:
+                    values = [row.get(name) for row in rows]
+                    try:
+                        arrays.append(pa.array(values))
+                    except (pa.ArrowInvalid, pa.ArrowTypeError):
+                        arrays.append(pa.array([None if v is None else as_text(v) for v in values], pa.string()))
+                return pa.Table.from_arrays(arrays, names=names)
+        
+        def merge_schemas(schema, other):
+            # Новые колонки добавляются, типы расширяются (int64 -> double),
+            # несовместимые типы одной колонки сводятся к строке
+            fields = {{field.name: field for field in schema}}
+            for field in other:
+                known = fields.get(field.name)
+                if known is None or pa.types.is_null(known.type):
+                    fields[field.name] = field
+                elif known.type != field.type and not pa.types.is_null(field.type):
+                    try:
+                        fields[field.name] = pa.unify_schemas(
+                            [pa.schema([known]), pa.schema([field])], promote_options='permissive'
+                        ).field(0)
+                    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                        fields[field.name] = pa.field(field.name, pa.string())
+            return pa.schema(list(fields.values()))
+        
+        def conform(column, arrow_type):
+            try:
+                return column.cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                if not pa.types.is_string(arrow_type):
+                    raise
+                return pa.array([None if v is None else as_text(v) for v in column.to_pylist()], arrow_type)
         
-        # Сохраняем во временное хранилище
-        df.to_parquet(f'/tmp/{source.id}_data.parquet', index=False)
+        def read_batches():
+            with open('{file_path}', 'rb') as f:
+                first_char = f.read(1)
+                while first_char.isspace():
+                    first_char = f.read(1)
+                f.seek(0)
+                if first_char == b'[':
+                    records = ijson.items(f, 'item', use_float=True)
+                else:
+                    # Одиночный объект - одна запись
+                    records = iter([next(ijson.items(f, '', use_float=True))])
+                
+                batch = []
+                for record in records:
+                    batch.append(record)
+                    if len(batch) >= 100_000:
+                        yield batch_table(batch)
+                        batch = []
+                if batch:
+                    yield batch_table(batch)
+        
+        schema = pa.schema([])
+        for table in read_batches():
+            schema = merge_schemas(schema, table.schema)
+        # Колонки, пустые во всем файле, записываем как строки
+        schema = pa.schema([
+            field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+            for field in schema
+        ])
+        
+        writer = HandOffWriter('{source.id}_data', schema)
+        row_count = 0
+        for table in read_batches():
+            # Колонки, отсутствующие в пачке, дополняем null
+            columns = [
+                conform(table[field.name], field.type) if field.name in table.column_names
+                else pa.nulls(table.num_rows, field.type)
+                for field in schema
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            row_count += table.num_rows
+        location = writer.close()
+'''
         
-        logging.info(f"Extracted {{len(df)}} rows from {source.name}")
-        return f'/tmp/{source.id}_data.parquet'
+        return f'''
+def extract_{source.id}(**context):
+    """Extract data from JSON source: {source.name}"""
+    try:
+        def flatten_table(table):
+            # Вложенные объекты разворачиваем в колонки вида parent.child
+            while any(pa.types.is_struct(field.type) for field in table.schema):
+                table = table.flatten()
+            return table
+{read_code}
+        logging.info(f"Extracted {{row_count}} rows from {source.name}")
+        return location
         
     except Exception as e:
         logging.error(f"Error extracting from {source.name}: {{str(e)}}")
         raise
 '''
     
+    @staticmethod
+    def _build_join_plan(
+        sources: List[DataSourceConfig],
+        relationships: List[DataRelationship],
+        recommendations: Dict[str, Any]
+    ) -> List[Tuple[str, str]]:
+        """План джойнов к основной таблице: пары (источник, ключ)"""
+        if not sources:
+            return []
+        
+        # Основная таблица - первая по списку
+        main_source = sources[0].id
+        
+        def row_count(value: Any) -> float:
+            # Отсутствующие и нечисловые оценки считаем нулевыми
+            if isinstance(value, dict):
+                value = value.get("row_count")
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+                return 0
+            return value
+        
+        # Оценки числа строк: из рекомендаций или из анализа источников
+        row_counts = {source.id: row_count(source.schema_info or {}) for source in sources}
+        stats = recommendations.get("stats")
+        if isinstance(stats, dict):
+            for source_id, source_stats in stats.items():
+                row_counts[source_id] = row_count(source_stats)
+        
+        join_plan = []
+        for rel in relationships:
+            if rel.source1_id == main_source:
+                other_source = rel.source2_id
+            else:
+                other_source = rel.source1_id
+            
+            join_key = next(iter(rel.join_keys), None)
+            if join_key and (other_source, join_key) not in join_plan:
+                join_plan.append((other_source, join_key))
+        
+        # Меньшие источники присоединяем первыми
+        join_plan.sort(key=lambda plan: row_counts.get(plan[0], 0))
+        return join_plan
+    
     def _generate_transform_function(
         self, 
         sources: List[DataSourceConfig], 
@@ -208,77 +646,74 @@ def extract_{source.id}(**context):
     ) -> str:
         """Генерация функции трансформации данных"""
         
+        # Результаты извлечения регистрируются в DuckDB как представления
+        source_ids = [source.id for source in sources]
+        
         # Создаем код для JOIN'ов
-        join_code = ""
-        if len(sources) > 1 and relationships:
-            join_code = "        # Объединение данных\n"
-            
-            # Находим основную таблицу (первую по списку)
-            main_source = sources[0].id
-            join_code += f"        result_df = dfs['{main_source}'].copy()\n"
-            
-            for rel in relationships:
-                if rel.source1_id == main_source:
-                    other_source = rel.source2_id
-                else:
-                    other_source = rel.source1_id
-                
-                # Создаем JOIN
-                join_keys = list(rel.join_keys.keys())
-                if join_keys:
-                    join_key = join_keys[0]
-                    join_code += f'''        
-        if '{other_source}' in dfs and '{join_key}' in result_df.columns and '{join_key}' in dfs['{other_source}'].columns:
-            result_df = result_df.merge(
-                dfs['{other_source}'], 
-                on='{join_key}', 
-                how='left',
-                suffixes=('', '_{other_source}')
+        join_plan = self._build_join_plan(sources, relationships, recommendations)
+        if len(sources) > 1 and join_plan:
+            join_code = JOIN_CODE_TEMPLATE.substitute(
+                join_plan=repr(join_plan),
+                main_source=repr(sources[0].id)
             )
-            logging.info(f"Joined with {other_source} on {join_key}")
-'''
         else:
             # Если нет связей, просто объединяем все данные
-            join_code = """        # Объединение всех источников данных
-        if len(dfs) == 1:
-            result_df= list(dfs.values())[0]
-        else:
-            # Простое вертикальное объединение (если структуры схожи)
-            result_df = pd.concat(list(dfs.values()), ignore_index=True, sort=False)
-"""
+            join_code = UNION_CODE
         
         return f'''
 def transform_data(**context):
     """Transform and join data from all sources"""
     try:
-        import pandas as pd
-        from datetime import datetime
+        import duckdb
         
-        # Загружаем данные из всех источников
-        dfs = {{}}
-        {chr(10).join([f"        dfs['{source.id}'] = pd.read_parquet(f'/tmp/{source.id}_data.parquet')" for source in sources])}
+        def quote_identifier(name):
+            return '"' + str(name).replace('"', '""') + '"'
         
-        logging.info("Loaded data from all sources")
-        
-{join_code}
-        
-        # Дополнительные трансформации
-        if 'result_df' in locals():
-            # Добавляем метку времени загрузки
-            result_df['etl_timestamp'] = datetime.now()
-            
-            # Удаляем дублирующиеся строки
-            result_df = result_df.drop_duplicates()
+        # Адреса результатов извлечения приходят через XCom. Parquet файлы
+        # читаются DuckDB напрямую, с проекцией и фильтрами по row group,
+        # Arrow таблицы регистрируются без копирования
+        source_ids = {source_ids!r}
+        con = duckdb.connect()
+        try:
+            columns = {{}}
+            for source_id in source_ids:
+                location = context['ti'].xcom_pull(task_ids=f'extract.extract_{{source_id}}')
+                if HAND_OFF == 'parquet_disk':
+                    relation = con.read_parquet(location)
+                else:
+                    relation = con.from_arrow(read_hand_off(location))
+                relation.create_view(source_id)
+                columns[source_id] = relation.columns
             
-            # Обработка пустых значений
-            result_df = result_df.fillna('')
+            logging.info("Loaded data from all sources")
             
-            logging.info(f"Transformed data: {{len(result_df)}} rows, {{len(result_df.columns)}} columns")
+{join_code}
+            # Удаляем дублирующиеся строки колоночным хешированием
+            result = con.execute(f"SELECT DISTINCT * FROM ({{query}})").fetch_arrow_table()
+        finally:
+            con.close()
+        
+        # Обработка пустых значений: текстовые колонки заполняем '',
+        # остальные сохраняют свой тип и null
+        for i, field in enumerate(result.schema):
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                result = result.set_column(i, field.name, pc.fill_null(result.column(i), ''))
+        
+        # Добавляем метку времени загрузки в UTC: одно значение на весь столбец;
+        # одноименная колонка источника заменяется, чтобы имена не повторялись
+        timestamp_type = pa.timestamp('us', tz='UTC')
+        loaded_at = pa.scalar(pd.Timestamp.now(tz='UTC'), timestamp_type)
+        etl_timestamp = pc.fill_null(pa.nulls(result.num_rows, timestamp_type), loaded_at)
+        index = result.schema.get_field_index('etl_timestamp')
+        if index >= 0:
+            result = result.set_column(index, 'etl_timestamp', etl_timestamp)
         else:
-            result_df = pd.DataFrame()  # Пустой DataFrame в случае ошибки
+            result = result.append_column('etl_timestamp', etl_timestamp)
         
-        # Сохраняем результат
-        result_df.to_parquet('/tmp/transformed_data.parquet', index=False)
+        logging.info(f"Transformed data: {{result.num_rows}} rows, {{result.num_columns}} columns")
+        
+        # Сохраняем результат без промежуточного DataFrame
+        papq.write_table(result, '/tmp/transformed_data.parquet', **PARQUET_OPTIONS)
         return '/tmp/transformed_data.parquet'
         
     except Exception as e:
@@ -293,74 +728,198 @@ def transform_data(**context):
         table_name = recommendations.get("schema_design", {}).get("main_table", "processed_data")
         
         if storage_type.lower() == "clickhouse":
-            return self._generate_clickhouse_load(table_name)
+            return self._generate_clickhouse_load(table_name, recommendations.get("schema_design") or {})
         else:
             return self._generate_postgres_load(table_name)
     
-    def _generate_clickhouse_load(self, table_name: str) -> str:
+    def _generate_clickhouse_load(self, table_name: str, schema_design: Dict[str, Any] = None) -> str:
         """Генерация функции загрузки в ClickHouse"""
+        schema_design = schema_design if isinstance(schema_design, dict) else {}
+        
+        # Партиционирование: явный partition_by или partitioning из рекомендаций
+        partition_by = schema_design.get("partition_by") or schema_design.get("partitioning")
+        if not isinstance(partition_by, str):
+            partition_by = ""
+        partition_by = re.sub(r"^\s*PARTITION\s+BY\s+", "", partition_by, flags=re.IGNORECASE).strip()
+        
+        # Первичный ключ: явный order_by или индексируемые колонки; колонки,
+        # которых нет в данных, отбрасываются уже в DAG по фактической схеме
+        order_by = self._column_names(schema_design.get("order_by")) or self._column_names(schema_design.get("indexes"))
+        low_cardinality = self._column_names(schema_design.get("low_cardinality"))
+        
+        # Окружение читается при каждом вызове и входит в ключ кэша
+        connection = tuple(os.getenv(name, default) for name, default in CLICKHOUSE_ENV_DEFAULTS)
+        return self._render_clickhouse_load(
+            table_name, connection, partition_by, order_by, low_cardinality
+        )
+    
+    @staticmethod
+    def _column_names(value: Any) -> Tuple[str, ...]:
+        """Имена колонок из рекомендаций LLM: строка через запятую или список строк, остальное отбрасывается"""
+        if isinstance(value, str):
+            value = value.strip().strip("()").split(",")
+        elif not isinstance(value, (list, tuple)):
+            return ()
+        return tuple(dict.fromkeys(col.strip() for col in value if isinstance(col, str) and col.strip()))
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _render_clickhouse_load(
+        table_name: str,
+        connection: tuple,
+        partition_by: str,
+        order_by: tuple,
+        low_cardinality: tuple
+    ) -> str:
+        """Код функции загрузки в ClickHouse для заданной таблицы, подключения и раскладки"""
+        host, port, user, password, database = connection
         return f'''
 def load_data(**context):
     """Load transformed data to ClickHouse"""
     try:
-        import pandas as pd
-        from clickhouse_driver import Client
+        import re
+        import requests
         
-        # Загружаем трансформированные данные
-        df = pd.read_parquet('/tmp/transformed_data.parquet')
+        parquet_path = '/tmp/transformed_data.parquet'
+        parquet_file = papq.ParquetFile(parquet_path)
+        row_count = parquet_file.metadata.num_rows
         
-        if len(df) == 0:
+        if row_count == 0:
             logging.warning("No data to load")
             return
         
-        # Подключение к ClickHouse
-        client = Client(
-            host='{os.getenv("CLICKHOUSE_HOST", "localhost")}',
-            port={os.getenv("CLICKHOUSE_PORT", "9000")},
-            user='{os.getenv("CLICKHOUSE_USER", "default")}',
-            password='{os.getenv("CLICKHOUSE_PASSWORD", "")}',
-            database='{os.getenv("CLICKHOUSE_DATABASE", "default")}'
-        )
+        # Подключение к ClickHouse через HTTP интерфейс
+        url = 'http://{host}:{port}/'
+        session = requests.Session()
+        session.headers.update({{
+            'X-ClickHouse-User': '{user}',
+            'X-ClickHouse-Key': '{password}',
+            'X-ClickHouse-Database': '{database}',
+        }})
+        
+        def run_query(query, data=None):
+            response = session.post(url, params={{'query': query}}, data=data, timeout=3600)
+            if response.status_code != 200:
+                raise RuntimeError(response.text.strip())
+            return response.text
+        
+        def clickhouse_type(arrow_type):
+            # Соответствие типов Arrow типам ClickHouse
+            if pa.types.is_boolean(arrow_type):
+                return 'UInt8'
+            if pa.types.is_integer(arrow_type):
+                prefix = 'Int' if pa.types.is_signed_integer(arrow_type) else 'UInt'
+                return f"{{prefix}}{{arrow_type.bit_width}}"
+            if pa.types.is_floating(arrow_type):
+                return 'Float64' if arrow_type.bit_width == 64 else 'Float32'
+            if pa.types.is_decimal(arrow_type):
+                return f"Decimal({{arrow_type.precision}}, {{arrow_type.scale}})"
+            if pa.types.is_timestamp(arrow_type):
+                precision = {{'s': 0, 'ms': 3, 'us': 6, 'ns': 9}}[arrow_type.unit]
+                if arrow_type.tz:
+                    return f"DateTime64({{precision}}, '{{arrow_type.tz}}')"
+                return f"DateTime64({{precision}})"
+            if pa.types.is_date(arrow_type):
+                return 'Date32'
+            if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+                return f"Array({{clickhouse_type(arrow_type.value_type)}})"
+            return 'String'
+        
+        # Колонки с пропусками находим по статистике Parquet, без чтения данных
+        schema = parquet_file.schema_arrow
+        metadata = parquet_file.metadata
+        nullable_columns = set()
+        for rg in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg)
+            for ci in range(row_group.num_columns):
+                column = row_group.column(ci)
+                stats = column.statistics
+                if stats is None or not stats.has_null_count or stats.null_count > 0:
+                    path = column.path_in_schema
+                    nullable_columns.update(
+                        name for name in schema.names if path == name or path.startswith(name + '.')
+                    )
+        
+        # Типы колонок ClickHouse определяем по схеме Parquet;
+        # категориальные строки из рекомендаций хранятся словарем
+        low_cardinality = {{col for col in {list(low_cardinality)!r} if col in schema.names}}
+        column_types = {{}}
+        for field in schema:
+            ch_type = clickhouse_type(field.type)
+            if field.name in nullable_columns and not ch_type.startswith('Array'):
+                ch_type = f"Nullable({{ch_type}})"
+            if field.name in low_cardinality and ch_type in ('String', 'Nullable(String)'):
+                ch_type = f"LowCardinality({{ch_type}})"
+            column_types[field.name] = ch_type
+        
+        # Раскладка таблицы из рекомендаций: ключи на отсутствующих колонках
+        # заменяются партициями по месяцу загрузки и сортировкой по ней
+        partition_by = {partition_by!r}
+        partition_columns = set(re.findall(r'\\b[A-Za-z_]\\w*\\b(?!\\s*\\()', partition_by))
+        if not partition_by or not partition_columns <= set(column_types):
+            partition_by = 'toYYYYMM(etl_timestamp)' if 'etl_timestamp' in column_types else ''
+            partition_columns = {{'etl_timestamp'}} if partition_by else set()
+        order_by = [col for col in {order_by!r} if col in column_types]
+        if not order_by and 'etl_timestamp' in column_types:
+            order_by = ['etl_timestamp']
+        
+        table_layout = []
+        if partition_by:
+            table_layout.append(f"PARTITION BY {{partition_by}}")
+        if order_by:
+            table_layout.append("ORDER BY (" + ", ".join(f"`{{col}}`" for col in order_by) + ")")
+        else:
+            table_layout.append("ORDER BY tuple()")
+        settings = "index_granularity = 8192"
+        if any(column_types[col].startswith('Nullable') for col in partition_columns | set(order_by)):
+            settings += ", allow_nullable_key = 1"
+        table_layout.append(f"SETTINGS {{settings}}")
+        table_layout = "\\n        ".join(table_layout)
         
         # Создаем таблицу если не существует
-        create_table_query = """
+        columns_ddl = ",\\n            ".join(f"`{{col}}` {{ch_type}}" for col, ch_type in column_types.items())
+        create_table_query = f"""
         CREATE TABLE IF NOT EXISTS {table_name} (
-            {chr(10).join([f"    {col} String," for col in ['col1', 'col2']])}  -- Автогенерация колонок
-            etl_timestamp DateTime
+            {{columns_ddl}}
         ) ENGINE = MergeTree()
-        ORDER BY etl_timestamp
+        {{table_layout}}
         """
         
         try:
-            client.execute(create_table_query)
+            run_query(create_table_query)
             logging.info("Table {table_name} created/verified")
         except Exception as e:
             logging.warning(f"Error creating table: {{str(e)}}")
         
-        # Загружаем данные
-        data_tuples = [tuple(row) for row in df.values]
+        # Передаем Parquet файл потоком: ClickHouse сам разбирает его колонками
+        column_list = ", ".join(f"`{{col}}`" for col in column_types)
+        with open(parquet_path, 'rb') as f:
+            run_query(f"INSERT INTO {table_name} ({{column_list}}) FORMAT Parquet", data=f)
         
-        client.execute(
-            f"INSERT INTO {table_name} VALUES",
-            data_tuples
-        )
+        logging.info(f"Loaded {{row_count}} rows to ClickHouse table {table_name}")
         
-        logging.info(f"Loaded {{len(df)}} rows to ClickHouse table {table_name}")
+        # Небольшие таблицы сливаем в одну часть; для больших OPTIMIZE FINAL слишком дорог
+        total_rows = int(run_query(
+            "SELECT sum(rows) FROM system.parts "
+            "WHERE active AND database = currentDatabase() AND table = '{table_name}'"
+        ).strip() or 0)
+        if total_rows <= 10_000_000:
+            run_query("OPTIMIZE TABLE {table_name} FINAL")
+            logging.info(f"Optimized ClickHouse table {table_name} ({{total_rows}} rows)")
         
     except Exception as e:
         logging.error(f"Error loading data to ClickHouse: {{str(e)}}")
         raise
 '''
     
-    def _generate_postgres_load(self, table_name: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _generate_postgres_load(table_name: str) -> str:
         """Генерация функции загрузки в PostgreSQL"""
         return f'''
 def load_data(**context):
     """Load transformed data to PostgreSQL"""
     try:
-        import pandas as pd
-        from airflow.providers.postgres.hooks.postgres import PostgresHook
-        
         # Загружаем трансформированные данные
         df = pd.read_parquet('/tmp/transformed_data.parquet')
         
@@ -376,30 +935,43 @@ def load_data(**context):
         CREATE TABLE IF NOT EXISTS {table_name} (
             id SERIAL PRIMARY KEY,
             data JSONB,  -- Для гибкости храним как JSONB
-            etl_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            etl_timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
         );
         """
         
         pg_hook.run(create_table_query)
         logging.info("Table {table_name} created/verified")
         
-        # Загружаем данные построчно
-        insert_query = f"""
-        INSERT INTO {table_name} (data, etl_timestamp) 
-        VALUES (%(data)s, %(timestamp)s)
-        """
+        # Готовим данные для COPY: JSON документ строки и метка времени
+        if 'etl_timestamp' in df.columns:
+            timestamps = df.pop('etl_timestamp')
+        else:
+            timestamps = pd.Series(pd.Timestamp.now(tz='UTC'), index=df.index)
         
-        for _, row in df.iterrows():
-            row_data = row.to_dict()
-            timestamp = row_data.pop('etl_timestamp', 'now()')
-            
-            pg_hook.run(
-                insert_query,
-                parameters={{
-                    'data': str(row_data),  # Конвертируем в JSON string
-                    'timestamp': timestamp
-                }}
-            )
+        # Сериализуем все строки в JSON одним векторизованным вызовом:
+        # NaN/None становятся null, даты - ISO строками, что валидно для JSONB;
+        # точность чисел максимальная (по умолчанию pandas округляет до 10 знаков)
+        documents = df.to_json(orient='records', lines=True, date_format='iso', double_precision=15)
+        payload = pd.DataFrame({{
+            'data': documents.rstrip('\\n').split('\\n'),
+            'etl_timestamp': timestamps.array
+        }})
+        
+        buf = io.StringIO()
+        payload.to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        
+        # Загружаем данные одним COPY вместо INSERT на каждую строку
+        conn = pg_hook.get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(
+                    "COPY {table_name} (data, etl_timestamp) FROM STDIN WITH CSV",
+                    buf
+                )
+            conn.commit()
+        finally:
+            conn.close()
         
         logging.info(f"Loaded {{len(df)}} rows to PostgreSQL table {table_name}")
         
@@ -415,9 +987,28 @@ def load_data(**context):
             os.makedirs(self.airflow_dags_path, exist_ok=True)
             
             dag_file_path = os.path.join(self.airflow_dags_path, f"{dag_name}.py")
+            data = dag_code.encode('utf-8')
             
-            with open(dag_file_path, 'w', encoding='utf-8') as f:
-                f.write(dag_code)
+            # Неизменившийся DAG не перезаписываем, чтобы планировщик не разбирал его заново
+            if os.path.exists(dag_file_path):
+                with open(dag_file_path, 'rb') as f:
+                    if f.read() == data:
+                        logger.info(f"DAG {dag_file_path} is up to date")
+                        return dag_file_path
+            
+            # Пишем во временный файл и атомарно подменяем, чтобы Airflow
+            # никогда не увидел частично записанный DAG
+            tmp_file_path = dag_file_path + '.tmp'
+            try:
+                with open(tmp_file_path, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file_path, dag_file_path)
+            except Exception:
+                if os.path.exists(tmp_file_path):
+                    os.remove(tmp_file_path)
+                raise
             
             logger.info(f"DAG saved to {dag_file_path}")
             return dag_file_path
@@ -426,11 +1017,28 @@ def load_data(**context):
             logger.error(f"Error saving DAG file: {str(e)}")
             raise
     
-    def generate_sql_scripts(self, recommendations: Dict[str, Any]) -> Dict[str, str]:
+    @staticmethod
+    def _index_columns(
+        recommendations: Dict[str, Any],
+        relationships: List[DataRelationship] = None
+    ) -> List[str]:
+        """Колонки для индексов: из рекомендаций или ключи джойнов"""
+        columns = recommendations.get("indexes") or recommendations.get("schema_design", {}).get("indexes") or []
+        if not columns and relationships:
+            columns = [key for rel in relationships for key in rel.join_keys]
+        # Убираем повторы, сохраняя порядок
+        return list(dict.fromkeys(col for col in columns if isinstance(col, str) and col))
+    
+    def generate_sql_scripts(
+        self,
+        recommendations: Dict[str, Any],
+        relationships: List[DataRelationship] = None
+    ) -> Dict[str, str]:
         """Генерация SQL скриптов для создания схемы"""
         
         ddl_script = recommendations.get("schema_design", {}).get("ddl_script", "")
         storage_type = recommendations.get("storage_recommendation", {}).get("primary", "postgresql")
+        table_name = recommendations.get("schema_design", {}).get("main_table")
         
         scripts = {
             "ddl": ddl_script
@@ -438,9 +1046,11 @@ def load_data(**context):
         
         # Добавляем дополнительные скрипты в зависимости от типа БД
         if storage_type == "clickhouse":
-            scripts["optimization"] = """
+            table_name = table_name or "analytics_data"
+            scripts["optimization"] = f"""
 -- Оптимизация для ClickHouse
-OPTIMIZE TABLE analytics_data FINAL;
+-- OPTIMIZE FINAL переписывает все части, выполняйте только для небольших таблиц
+OPTIMIZE TABLE {table_name} FINAL;
 
 -- Проверка размера таблицы
 SELECT 
@@ -448,26 +1058,44 @@ SELECT
     formatReadableSize(sum(bytes)) as size,
     sum(rows) as rows
 FROM system.parts 
-WHERE table = 'analytics_data' 
+WHERE active AND table = '{table_name}' 
 GROUP BY table;
 """
         else:
-            scripts["optimization"] = """
+            table_name = table_name or "processed_data"
+            
+            # Индексы по колонкам фильтров и джойнов; данные строк хранятся в JSONB
+            index_ddl = [
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_{table_name}_etl_timestamp\n"
+                f"ON {table_name}(etl_timestamp);"
+            ]
+            for col in self._index_columns(recommendations, relationships):
+                index_name = re.sub(r"\W+", "_", f"idx_{table_name}_{col}")[:63]
+                escaped_col = col.replace("'", "''")
+                index_ddl.append(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name}\n"
+                    f"ON {table_name} ((data->>'{escaped_col}'));"
+                )
+            index_ddl = "\n\n".join(index_ddl)
+            
+            scripts["optimization"] = f"""
 -- Оптимизация для PostgreSQL
-ANALYZE processed_data;
+-- Индексы по колонкам фильтров и джойнов
+{index_ddl}
 
--- Создание дополнительных индексов при необходимости  
--- CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_processed_data_timestamp 
--- ON processed_data(etl_timestamp);
+-- Обновление статистики планировщика после загрузки
+VACUUM (ANALYZE) {table_name};
 
 -- Статистика по таблице
 SELECT 
     schemaname,
-    tablename,
+    relname,
     n_tup_ins as inserts,
     n_tup_upd as updates,
-    n_tup_del as deletes
+    n_tup_del as deletes,
+    last_analyze,
+    last_autoanalyze
 FROM pg_stat_user_tables 
-WHERE tablename = 'processed_data';"""
+WHERE relname = '{table_name}';"""
         
         return scripts
@@ -1,24 +1,329 @@
 import streamlit as st
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
 import os
+import gzip
+import hashlib
+import json
+import shelve
+import threading
+import time
+import uuid
 
 # Конфигурация
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+# Таймауты запросов к backend: (подключение, чтение)
+REQUEST_TIMEOUT = (3, 60)
+# Генерация рекомендаций ждет ответа LLM и идет в фоновом потоке
+RECOMMENDATIONS_TIMEOUT = (3, 120)
+# Сколько секунд повторный запрос с теми же входными данными отвечается из кэша
+RECOMMENDATIONS_CACHE_TTL = 1800
+# Сколько ответов хранит кэш рекомендаций, общий для всех сессий
+RECOMMENDATIONS_CACHE_SIZE = 64
+
+# Backend анализирует только первый мегабайт CSV, остаток файла не отправляем
+CSV_SAMPLE_BYTES = 1 << 20
+
+# Источники и рекомендации сохраняются между перезагрузками страницы
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", ".cache/streamlit_sessions")
+SESSION_STORE_VERSION = 5
+# Секреты подключений в хранилище не попадают и запрашиваются заново после перезагрузки;
+# текст DAG тоже не сохраняется - в нем параметры подключения к хранилищу
+SECRET_CONFIG_KEYS = ("password",)
+
+# Подписи частоты обновления данных
+FREQUENCY_LABELS = {
+    "once": "Разово",
+    "hourly": "Каждый час",
+    "daily": "Каждый день",
+    "weekly": "Каждую неделю",
+    "realtime": "Реальное время"
+}
+
+# Инструкция по развертыванию: общий текст и подстановки для каждого хранилища
+DEPLOY_INSTRUCTIONS = """
+**Шаги для развертывания:**
+
+1. **Настройка окружения:**
+
+   # Установка зависимостей
+   ```
+   pip install apache-airflow apache-airflow-providers-postgres pandas pyarrow duckdb ijson $driver
+   ```
+
+2. **Настройка подключений в Airflow:**
+
+   # Airflow Connections
+   ```
+   $connection
+   ```
+ 
+3. **Загрузка DAG файла:**
+   
+   # Скопировать в папку dags Airflow
+   ```
+   cp $dag_file $AIRFLOW_HOME/dags/
+   ```
+   
+
+4. **Выполнение SQL скриптов:**
+   
+   -- Выполнить DDL скрипты для создания таблиц
+   
+
+5. **Активация DAG в Airflow UI**
+        """
+
+# Шаблоны собираются один раз; при отображении подставляется только имя DAG файла
+# (safe_substitute оставляет $AIRFLOW_HOME как есть)
+DEPLOY_TEMPLATES = {
+    "clickhouse": Template(Template(DEPLOY_INSTRUCTIONS).safe_substitute(
+        driver="requests",
+        connection="ClickHouse: HTTP-интерфейс (порт 8123), параметры подключения заданы в DAG"
+    )),
+    "postgresql": Template(Template(DEPLOY_INSTRUCTIONS).safe_substitute(
+        driver="psycopg2-binary",
+        connection="PostgreSQL: postgres_default"
+    ))
+}
+
 st.set_page_config(
     page_title="🤖 ИИ-ассистент Data Engineer",
     page_icon="🚀",
     layout="wide"
 )
 
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Общая сессия с пулом keep-alive соединений и повторами для запросов к backend"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        # Повторы по умолчанию только для идемпотентных методов: POST повторяется
+        # лишь при ошибке подключения, чтобы не запускать анализ или LLM повторно
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504]
+        )
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def get_store() -> tuple:
+    """Локальное хранилище состояния сессий и блокировка доступа к нему"""
+    os.makedirs(os.path.dirname(SESSION_STORE_PATH) or ".", exist_ok=True)
+    return shelve.open(SESSION_STORE_PATH), threading.Lock()
+
+def warm_up_backend():
+    """Фоновый HEAD /health: keep-alive соединение открывается до первого действия пользователя"""
+    session = get_session()
+    get_executor().submit(session.head, f"{BACKEND_URL}/health", timeout=(2, 2))
+
+def session_token() -> str:
+    """Токен сессии хранится в URL, поэтому переживает перезагрузку страницы"""
+    if "sid" not in st.query_params:
+        st.query_params["sid"] = uuid.uuid4().hex
+    return st.query_params["sid"]
+
+def load_state() -> dict:
+    """Состояние сессии из хранилища; записи другой версии или другого backend удаляются"""
+    store, lock = get_store()
+    with lock:
+        entry = store.get(session_token(), {})
+        if entry.get("version") != SESSION_STORE_VERSION or entry.get("backend_url") != BACKEND_URL:
+            # Записи старых версий могли содержать пароли и текст DAG
+            store.pop(session_token(), None)
+            return {}
+    return entry
+
+def without_secrets(source: dict) -> dict:
+    """Копия источника без паролей в конфигурации"""
+    return {**source, "config": {k: v for k, v in source.get("config", {}).items() if k not in SECRET_CONFIG_KEYS}}
+
+def needs_password(source: dict) -> bool:
+    """Источнику из БД нужен пароль (например, после восстановления сессии)"""
+    return source["type"] in ("postgresql", "clickhouse") and not source["config"].get("password")
+
+def prompt_password(source: dict, key: str):
+    """Повторный запрос пароля; он хранится только в session_state"""
+    password = st.text_input(f"🔑 Пароль для {source['name']}", type="password", key=key)
+    if password:
+        source["config"]["password"] = password
+        st.rerun()
+
+def without_dag(recommendations: dict) -> dict:
+    """Копия рекомендаций без текста сгенерированного DAG"""
+    if not recommendations:
+        return recommendations
+    generated_code = {k: v for k, v in recommendations.get("generated_code", {}).items() if k != "airflow_dag"}
+    return {**recommendations, "generated_code": generated_code}
+
+def save_state():
+    """Сохранение источников и рекомендаций текущей сессии (без паролей и DAG)"""
+    store, lock = get_store()
+    with lock:
+        store[session_token()] = {
+            "version": SESSION_STORE_VERSION,
+            "backend_url": BACKEND_URL,
+            "sources": {source_id: without_secrets(source) for source_id, source in st.session_state.sources.items()},
+            "pending_sources": [without_secrets(source) for source in st.session_state.pending_sources],
+            "recommendations": without_dag(st.session_state.recommendations)
+        }
+        store.sync()
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Пул потоков для параллельных запросов к backend"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="backend")
+
+def sample_table(sample_data: list) -> "pa.Table":
+    """Превью данных в Arrow: st.dataframe принимает таблицу без промежуточного DataFrame"""
+    import pyarrow as pa  # импорт при первом добавлении источника, а не при старте
+    
+    try:
+        return pa.Table.from_pylist(sample_data)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Колонки со смешанными типами показываем строками
+        return pa.Table.from_pylist([
+            {col: None if value is None else str(value) for col, value in row.items()}
+            for row in sample_data
+        ])
+
+def prepare_schema(schema_info: dict) -> dict:
+    """Данные для отображения источника считаются один раз при его добавлении"""
+    total = schema_info.get('row_count', 0) * len(schema_info.get('columns', []))
+    nulls = sum(schema_info.get('null_counts', {}).values())
+    schema_info['fill_rate'] = (total - nulls) / max(total, 1)
+    schema_info['sample_table'] = sample_table(schema_info.get('sample_data', []))
+    return schema_info
+
+def backend_sources() -> list:
+    """Источники для отправки на backend: без Arrow-превью, которое нужно только интерфейсу"""
+    return [
+        {**source, "schema_info": {k: v for k, v in source["schema_info"].items() if k != "sample_table"}}
+        if source.get("schema_info") else source
+        for source in st.session_state.sources.values()
+    ]
+
+@st.cache_resource
+def get_llm_semaphore() -> threading.Semaphore:
+    """Ограничение числа одновременных запросов к LLM со всего приложения"""
+    return threading.Semaphore(2)
+
+def gzip_json(payload) -> dict:
+    """Аргументы запроса с JSON-телом, сжатым gzip; backend распаковывает такие тела сам"""
+    return {
+        "data": gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), compresslevel=6),
+        "headers": {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+    }
+
+@st.cache_resource
+def get_recommendations_cache() -> tuple:
+    """Полученные рекомендации по хэшу входных данных {ключ: (время, рекомендации)} и блокировка:
+    кэш общий для всех сессий, фрагменты которых выполняются в разных потоках"""
+    return OrderedDict(), threading.Lock()
+
+def recommendations_key(request_data: dict) -> str:
+    """Стабильный хэш источников и бизнес-требований"""
+    return hashlib.sha1(json.dumps(request_data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def drop_expired_recommendations(cache: OrderedDict):
+    """Удаление устаревших записей; вызывается под блокировкой кэша"""
+    now = time.monotonic()
+    for key in [key for key, (created, _) in cache.items() if now - created >= RECOMMENDATIONS_CACHE_TTL]:
+        del cache[key]
+
+def cached_recommendations(request_key: str):
+    """Ответ из кэша для тех же входных данных или None"""
+    cache, lock = get_recommendations_cache()
+    with lock:
+        drop_expired_recommendations(cache)
+        entry = cache.get(request_key)
+        return entry[1] if entry else None
+
+def remember_recommendations(request_key: str, recommendations: dict):
+    """Сохранение ответа в кэш; самые старые записи сверх RECOMMENDATIONS_CACHE_SIZE удаляются"""
+    cache, lock = get_recommendations_cache()
+    with lock:
+        drop_expired_recommendations(cache)
+        cache[request_key] = (time.monotonic(), recommendations)
+        cache.move_to_end(request_key)
+        while len(cache) > RECOMMENDATIONS_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def post_recommendations(session: requests.Session, semaphore: threading.Semaphore, request_data: dict) -> requests.Response:
+    """Запрос рекомендаций; выполняется в пуле потоков, а не в потоке скрипта"""
+    with semaphore:
+        return session.post(
+            f"{BACKEND_URL}/generate-recommendations",
+            **gzip_json(request_data),
+            timeout=RECOMMENDATIONS_TIMEOUT
+        )
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def analyze_csv(file_head: bytes, file_name: str) -> dict:
+    """Анализ начала CSV файла на backend; повторная загрузка того же файла берется из кэша"""
+    response = get_session().post(
+        f"{BACKEND_URL}/upload-csv",
+        files={"file": (file_name, file_head, "text/csv")},
+        timeout=REQUEST_TIMEOUT
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"Ошибка анализа файла: {response.text}")
+    schema_info = response.json()["schema"]
+    if not schema_info.get("columns"):
+        # Неудачный анализ не кэшируем
+        raise RuntimeError("Не удалось определить структуру файла")
+    return prepare_schema(schema_info)
+
+def next_source_id() -> str:
+    """Свободный идентификатор для нового источника"""
+    number = len(st.session_state.sources) + 1
+    while f"source_{number}" in st.session_state.sources:
+        number += 1
+    return f"source_{number}"
+
+def analyze_pending_sources():
+    """Анализ всех источников из очереди одним запросом к backend"""
+    pending = st.session_state.pending_sources
+    response = get_session().post(f"{BACKEND_URL}/analyze-sources", json=pending, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"Ошибка анализа: {response.text}")
+    
+    failed = []
+    for source, schema_info in zip(pending, response.json()):
+        if schema_info.get("columns"):
+            source["id"] = next_source_id()
+            source["schema_info"] = prepare_schema(schema_info)
+            st.session_state.sources[source["id"]] = source
+        else:
+            failed.append(source)
+    
+    st.session_state.pending_sources = failed
+    save_state()
+    if failed:
+        raise RuntimeError(f"Не удалось определить структуру: {', '.join(source['name'] for source in failed)}")
+
 def main():
     st.title("🤖 ИИ-ассистент Data Engineer")
     st.markdown("### Автоматическая генерация ETL пайплайнов с помощью ИИ")
     
-    # Инициализация session state
+    # Инициализация session state (с восстановлением после перезагрузки страницы)
     if 'sources' not in st.session_state:
-        st.session_state.sources = []
+        warm_up_backend()
+        saved_state = load_state()
+        st.session_state.sources = saved_state.get("sources", {})
+        st.session_state.pending_sources = saved_state.get("pending_sources", [])
+        st.session_state.recommendations = saved_state.get("recommendations")
     if 'recommendations' not in st.session_state:
         st.session_state.recommendations = None
     
@@ -61,28 +366,24 @@ def handle_data_sources():
                 if st.button("Анализировать CSV"):
                     with st.spinner("Анализ файла..."):
                         try:
-                            files = {"file": uploaded_file}
-                            response = requests.post(f"{BACKEND_URL}/upload-csv", files=files)
+                            uploaded_file.seek(0)
+                            schema_info = analyze_csv(uploaded_file.read(CSV_SAMPLE_BYTES), uploaded_file.name)
                             
-                            if response.status_code == 200:
-                                result = response.json()
-                                
-                                source = {
-                                    "id": f"source_{len(st.session_state.sources) + 1}",
-                                    "name": source_name,
-                                    "type": "csv",
-                                    "config": {
-                                        "delimiter": delimiter,
-                                        "encoding": encoding
-                                    },
-                                    "schema_info": result["schema"]
-                                }
-                                
-                                st.session_state.sources.append(source)
-                                st.success(f"✅ CSV файл '{source_name}' успешно добавлен!")
-                                st.rerun()
-                            else:
-                                st.error(f"Ошибка анализа файла: {response.text}")
+                            source = {
+                                "id": next_source_id(),
+                                "name": source_name,
+                                "type": "csv",
+                                "config": {
+                                    "delimiter": delimiter,
+                                    "encoding": encoding
+                                },
+                                "schema_info": schema_info
+                            }
+                            
+                            st.session_state.sources[source["id"]] = source
+                            save_state()
+                            st.success(f"✅ CSV файл '{source_name}' успешно добавлен!")
+                            st.rerun()
                         except Exception as e:
                             st.error(f"Ошибка: {str(e)}")
         
@@ -102,19 +403,25 @@ def handle_data_sources():
             if all([host, database, username, password, table, source_name]):
                 col_test, col_add = st.columns(2)
                 
+                source = {
+                    "id": next_source_id(),
+                    "name": source_name,
+                    "type": "postgresql",
+                    "config": {
+                        "host": host,
+                        "port": port,
+                        "database": database,
+                        "username": username,
+                        "password": password,
+                        "table": table
+                    }
+                }
+                config = {"type": "postgresql", **source["config"]}
+                
                 with col_test:
                     if st.button("Тест подключения"):
-                        config = {
-                            "type": "postgresql",
-                            "host": host,
-                            "port": port,
-                            "database": database,
-                            "username": username,
-                            "password": password
-                        }
-                        
                         try:
-                            response = requests.post(f"{BACKEND_URL}/test-connection", json=config)
+                            response = get_session().post(f"{BACKEND_URL}/test-connection", json=config, timeout=REQUEST_TIMEOUT)
                             result = response.json()
                             
                             if result["status"] == "success":
@@ -126,80 +433,44 @@ def handle_data_sources():
                 
                 with col_add:
                     if st.button("Добавить источник"):
-                        source = {
-                            "id": f"source_{len(st.session_state.sources) + 1}",
-                            "name": source_name,
-                            "type": "postgresql",
-                            "config": {
-                                "host": host,
-                                "port": port,
-                                "database": database,
-                                "username": username,
-                                "password": password,
-                                "table": table
-                            }
-                        }
-                        
-                        # Анализируем структуру
-                        try:
-                            response = requests.post(f"{BACKEND_URL}/analyze-source", json=source)
-                            if response.status_code == 200:
-                                source["schema_info"] = response.json()
-                                st.session_state.sources.append(source)
-                                st.success(f"✅ PostgreSQL источник '{source_name}' добавлен!")
-                                st.rerun()
-                            else:
-                                st.error(f"Ошибка анализа: {response.text}")
-                        except Exception as e:
-                            st.error(f"Ошибка: {str(e)}")
+                        # Структура анализируется пакетно вместе с остальными источниками из очереди
+                        st.session_state.pending_sources.append(source)
+                        save_state()
+                        st.rerun()
+    
+    # Источники, ожидающие анализа структуры
+    if st.session_state.pending_sources:
+        st.info(f"⏳ Ожидают анализа: {', '.join(source['name'] for source in st.session_state.pending_sources)}")
+        for i, source in enumerate(st.session_state.pending_sources):
+            if needs_password(source):
+                prompt_password(source, key=f"pending_password_{i}")
+        if st.button(
+            f"🔬 Проанализировать все ({len(st.session_state.pending_sources)})",
+            disabled=any(needs_password(source) for source in st.session_state.pending_sources)
+        ):
+            with st.spinner("Анализ источников..."):
+                try:
+                    analyze_pending_sources()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Ошибка: {str(e)}")
     
     # Отображение добавленных источников
     if st.session_state.sources:
         st.subheader("📊 Добавленные источники")
         
-        for i, source in enumerate(st.session_state.sources):
-            with st.expander(f"🔍 {source['name']} ({source['type']})", expanded=False):
-                if source.get('schema_info'):
-                    schema = source['schema_info']
-                    
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        st.metric("Колонки", len(schema.get('columns', [])))
-                    with col2:
-                        st.metric("Строки", schema.get('row_count', 0))
-                    with col3:
-                        st.metric("Заполненность", f"{((schema.get('row_count', 0) * len(schema.get('columns', [])) - sum(schema.get('null_counts', {}).values())) / max(schema.get('row_count', 0) * len(schema.get('columns', [])), 1) * 100):.1f}%")
-                    
-                    # Таблица колонок
-                    if schema.get('columns'):
-                        df_schema = pd.DataFrame({
-                            'Колонка': schema['columns'],
-                            'Тип': [schema.get('dtypes', {}).get(col, 'unknown') for col in schema['columns']],
-                            'Пустые значения': [schema.get('null_counts', {}).get(col, 0) for col in schema['columns']],
-                            'Уникальные': [schema.get('unique_counts', {}).get(col, 0) for col in schema['columns']]
-                        })
-                        st.dataframe(df_schema, use_container_width=True)
-                    
-                    # Превью данных
-                    if schema.get('sample_data'):
-                        st.subheader("👀 Превью данных")
-                        sample_df = pd.DataFrame(schema['sample_data'])
-                        st.dataframe(sample_df, use_container_width=True)
-                
-                # Кнопка удаления
-                if st.button(f"🗑️ Удалить {source['name']}", key=f"delete_{i}"):
-                    st.session_state.sources.pop(i)
-                    st.rerun()
+        for source in st.session_state.sources.values():
+            render_source(source)
         
         # Автоматический поиск связей
         if len(st.session_state.sources) > 1:
             if st.button("🔗 Найти связи между источниками"):
                 with st.spinner("Поиск связей..."):
                     try:
-                        response = requests.post(
+                        response = get_session().post(
                             f"{BACKEND_URL}/find-relationships", 
-                            json=st.session_state.sources
+                            **gzip_json(backend_sources()),
+                            timeout=REQUEST_TIMEOUT
                         )
                         
                         if response.status_code == 200:
@@ -222,6 +493,58 @@ def handle_data_sources():
                     except Exception as e:
                         st.error(f"Ошибка: {str(e)}")
 
+@st.cache_data(show_spinner=False)
+def schema_dataframe(columns: list, dtypes: dict, null_counts: dict, unique_counts: dict,
+                     row_count: int, fill_rate: float) -> "pd.DataFrame":
+    """Таблица колонок источника с итогами в заголовке; строится один раз на источник"""
+    import pandas as pd  # pandas нужен только для отображения источников
+    
+    summary = f"Колонки: {len(columns)} · Строки: {row_count} · Заполненность: {fill_rate * 100:.1f}%"
+    df = pd.DataFrame({
+        'Колонка': columns,
+        'Тип': [dtypes.get(col, 'unknown') for col in columns],
+        'Пустые значения': [null_counts.get(col, 0) for col in columns],
+        'Уникальные': [unique_counts.get(col, 0) for col in columns]
+    })
+    df.columns = pd.MultiIndex.from_product([[summary], df.columns])
+    return df
+
+@st.fragment
+def render_source(source: dict):
+    """Карточка добавленного источника; перерисовывается независимо от остальной страницы"""
+    if needs_password(source):
+        prompt_password(source, key=f"password_{source['id']}")
+    
+    with st.expander(f"🔍 {source['name']} ({source['type']})", expanded=False):
+        if source.get('schema_info'):
+            schema = source['schema_info']
+            
+            # Таблица колонок вместе с итогами по источнику
+            if schema.get('columns'):
+                st.dataframe(
+                    schema_dataframe(
+                        schema['columns'],
+                        schema.get('dtypes', {}),
+                        schema.get('null_counts', {}),
+                        schema.get('unique_counts', {}),
+                        schema.get('row_count', 0),
+                        schema.get('fill_rate', 0)
+                    ),
+                    width="stretch",
+                    height=240
+                )
+            
+            # Превью данных
+            if schema.get('sample_data'):
+                st.subheader("👀 Превью данных")
+                st.dataframe(schema['sample_table'], width="stretch")
+        
+        # Кнопка удаления
+        if st.button(f"🗑️ Удалить {source['name']}", key=f"delete_{source['id']}"):
+            del st.session_state.sources[source['id']]
+            save_state()
+            st.rerun()
+
 def handle_business_requirements():
     """Обработка бизнес-требований"""
     st.header("🎯 Бизнес-требования")
@@ -254,14 +577,8 @@ def handle_business_requirements():
         
         update_frequency = st.selectbox(
             "Частота обновления:",
-            ["once", "hourly", "daily", "weekly", "realtime"],
-            format_func=lambda x: {
-                "once": "Разово",
-                "hourly": "Каждый час", 
-                "daily": "Каждый день",
-                "weekly": "Каждую неделю",
-                "realtime": "Реальное время"
-            }[x]
+            list(FREQUENCY_LABELS),
+            format_func=FREQUENCY_LABELS.get
         )
     
     with col2:
@@ -295,33 +612,67 @@ def handle_recommendations(business_requirements):
     """Генерация и отображение рекомендаций"""
     st.header("🚀 ИИ Рекомендации")
     
-    if st.button("🧠 Получить рекомендации от ИИ", type="primary", use_container_width=True):
-        with st.spinner("🤖 ИИ анализирует данные и генерирует рекомендации..."):
-            try:
-                request_data = {
-                    "sources": st.session_state.sources,
-                    "business_requirements": business_requirements
-                }
-                
-                response = requests.post(
-                    f"{BACKEND_URL}/generate-recommendations",
-                    json=request_data,
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    st.session_state.recommendations = response.json()
-                    st.success("✅ Рекомендации получены!")
-                    st.rerun()
-                else:st.error(f"Ошибка генерации рекомендаций: {response.text}")
-                    
-            except Exception as e:
-                st.error(f"Ошибка: {str(e)}")
+    pending = st.session_state.get("recommendations_future") is not None
+    
+    if st.button("🧠 Получить рекомендации от ИИ", type="primary", width="stretch", disabled=pending):
+        request_data = {
+            "sources": backend_sources(),
+            "business_requirements": business_requirements
+        }
+        request_key = recommendations_key(request_data)
+        
+        # Те же источники и требования - ответ уже есть, LLM не вызываем
+        cached = cached_recommendations(request_key)
+        if cached:
+            st.session_state.recommendations = cached
+            save_state()
+        else:
+            st.session_state.recommendations_key = request_key
+            st.session_state.recommendations_future = get_executor().submit(
+                post_recommendations, get_session(), get_llm_semaphore(), request_data
+            )
+        st.rerun()
+    
+    if pending:
+        poll_recommendations()
+    
+    if st.session_state.get("recommendations_error"):
+        st.error(st.session_state.pop("recommendations_error"))
     
     # Отображение рекомендаций
     if st.session_state.recommendations:
         display_recommendations(st.session_state.recommendations)
 
+@st.fragment(run_every=1)
+def poll_recommendations():
+    """Ожидание фонового запроса рекомендаций без блокировки остальных виджетов"""
+    future = st.session_state.get("recommendations_future")
+    if future is None:
+        return
+    
+    if not future.done():
+        st.info("🤖 ИИ анализирует данные и генерирует рекомендации...")
+        if st.button("Отменить"):
+            future.cancel()
+            st.session_state.recommendations_future = None
+            st.rerun()
+        return
+    
+    st.session_state.recommendations_future = None
+    try:
+        response = future.result()
+        if response.status_code == 200:
+            st.session_state.recommendations = response.json()
+            remember_recommendations(st.session_state.recommendations_key, st.session_state.recommendations)
+            save_state()
+        else:
+            st.session_state.recommendations_error = f"Ошибка генерации рекомендаций: {response.text}"
+    except Exception as e:
+        st.session_state.recommendations_error = f"Ошибка: {str(e)}"
+    
+    # Рекомендации нужны и на других вкладках - перезапускаем всю страницу
+    st.rerun()
+
 def display_recommendations(recommendations):
     """Отображение рекомендаций"""
     st.subheader("📊 Результат анализа")
@@ -431,12 +782,14 @@ def display_generated_code():
     if generated_code.get("airflow_dag"):
         st.code(generated_code["airflow_dag"], language="python")
         
-        # Кнопка скачивания
+        # Кнопка скачивания (файл формируется только при нажатии)
         st.download_button(
             "📥 Скачать DAG файл",
-            data=generated_code["airflow_dag"],
+            data=lambda: generated_code["airflow_dag"].encode("utf-8"),
             file_name=f"{st.session_state.recommendations.get('project_info', {}).get('name', 'generated')}_dag.py",mime="text/python"
         )
+    else:
+        st.info("DAG не сохраняется между перезагрузками страницы: получите рекомендации заново")
     
     # SQL скрипты
     st.subheader("🗄️ SQL Скрипты")
@@ -455,12 +808,12 @@ def display_generated_code():
             st.code(scripts["optimization"], language="sql")
         
         # Кнопка скачивания всех скриптов
-        all_scripts = "\n\n-- DDL Script\n" + scripts.get("ddl", "")
-        all_scripts += "\n\n-- Optimization Script\n" + scripts.get("optimization", "")
-        
         st.download_button(
             "📥 Скачать SQL скрипты",
-            data=all_scripts,
+            data=lambda: (
+                "\n\n-- DDL Script\n" + scripts.get("ddl", "")
+                + "\n\n-- Optimization Script\n" + scripts.get("optimization", "")
+            ).encode("utf-8"),
             file_name="generated_scripts.sql",
             mime="text/sql"
         )
@@ -480,38 +833,8 @@ def display_generated_code():
         st.markdown("### 🚀 Инструкция по развертыванию")
         
         storage_type = st.session_state.recommendations["recommendations"]["storage_recommendation"]["primary"]
-        deploy_instructions = f"""
-**Шаги для развертывания:**
-
-1. **Настройка окружения:**
-
-   # Установка зависимостей
-   ```
-   pip install apache-airflow pandas {'clickhouse-driver' if storage_type == 'clickhouse' else 'psycopg2-binary'}
-   ```
-
-2. **Настройка подключений в Airflow:**
-
-   # Airflow Connections
-   ```
-   {'ClickHouse: clickhouse_default' if storage_type == 'clickhouse' else 'PostgreSQL: postgres_default'}
-   ```
- 
-3. **Загрузка DAG файла:**
-   
-   # Скопировать в папку dags Airflow
-   ```
-   cp generated_dag.py $AIRFLOW_HOME/dags/
-   ```
-   
-
-4. **Выполнение SQL скриптов:**
-   
-   -- Выполнить DDL скрипты для создания таблиц
-   
-
-5. **Активация DAG в Airflow UI**
-        """
+        deploy_template = DEPLOY_TEMPLATES.get(storage_type, DEPLOY_TEMPLATES["postgresql"])
+        deploy_instructions = deploy_template.safe_substitute(dag_file=f"{project_info.get('name', 'generated')}_dag.py")
         
         st.markdown(deploy_instructions)
 